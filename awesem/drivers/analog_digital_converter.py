@@ -5,7 +5,7 @@ through I2C interface.
 Linear Technology Datasheet: https://www.analog.com/media/en/technical-documentation/data-sheets/23015fb.pdf
 """
 
-import smbus
+import numpy as np
 from aenum import Constant
 
 from awesem import is_machine_raspberry_pi
@@ -28,18 +28,23 @@ class AnalogDigitalConverter:
 
     def __init__(self):
         if is_machine_raspberry_pi():
+            # Only built on the Pi, so it's imported here rather than when the web app loads
+            import smbus
             self.i2c_bus = smbus.SMBus(1)
         else:
             logger.info("Mock: Initialized ADC")
 
-    def read_voltage(self, channel):
+    def _get_adc_command(self, channel) -> int:
         if(int(channel) == 0):
-            adc_command = self.CH_0_READ
+            return self.CH_0_READ
         elif(int(channel) == 1):
-            adc_command = self.CH_1_READ
+            return self.CH_1_READ
         else:
             raise ValueError("Invalid channel selection")
 
+    def read_voltage(self, channel):
+        adc_command = self._get_adc_command(channel)
+
         if is_machine_raspberry_pi():
             try:
                 adc_code = self.i2c_bus.read_word_data(self.DEVICE_ADDRESS, adc_command)
@@ -56,6 +61,53 @@ class AnalogDigitalConverter:
 
         return voltage
 
+    def read_samples(self, channels=(CH0,), num_samples:int=1) -> np.ndarray:
+        """Reads a burst of samples, interleaving the channels (ie. CH0, CH1, CH0, ...)
+        so samples of different channels are taken at nearly the same time.
+
+        A conversion is started by the stop condition of each read, with the channel
+        selected in that read, and its result is returned by the next read (see the
+        datasheet). So one extra read is made and each result is assigned to the channel
+        selected in the read before it.
+
+        Args:
+            channels (tuple, optional): Channels to sample. Defaults to (CH0,).
+            num_samples (int, optional): Number of samples per channel. Defaults to 1.
+
+        Returns:
+            np.ndarray: Voltages of shape (num_samples, number of channels)
+        """
+        adc_commands = [self._get_adc_command(channel) for channel in channels] * num_samples
+
+        if not is_machine_raspberry_pi():
+            return np.random.random((num_samples, len(channels)))
+
+        adc_codes = np.empty(len(adc_commands), dtype=np.uint16)
+
+        try:
+            self.i2c_bus.read_word_data(self.DEVICE_ADDRESS, adc_commands[0])
+            for i, adc_command in enumerate(adc_commands[1:] + adc_commands[:1]):
+                adc_codes[i] = self.i2c_bus.read_word_data(self.DEVICE_ADDRESS, adc_command)
+        except OSError:
+            logger.exception(f"Could not read {self.DEVICE_ADDRESS} burst of {num_samples} samples. Returning 0V.")
+            return np.zeros((num_samples, len(channels)))
+
+        adc_codes = adc_codes.byteswap() >> self.OFFSET     # swap MSB and LSB, right shift 4 bits
+        voltages = adc_codes * (self.REFERENCE_VOLTAGE / self.RESOLUTION_STEPS)
+
+        return voltages.reshape(num_samples, len(channels))
+
+    def read_voltage_stats(self, channels=(CH0,), num_samples:int=16):
+        """Reads a burst of samples and returns their mean and standard deviation per
+        channel (see read_samples)
+
+        Returns:
+            np.ndarray, np.ndarray: Mean and standard deviation of each channel's voltage
+        """
+        voltages = self.read_samples(channels, num_samples)
+
+        return voltages.mean(axis=0), voltages.std(axis=0)
+
 if __name__ == "__main__":
     import time
 
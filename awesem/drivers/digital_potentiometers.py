@@ -13,11 +13,186 @@ the control of the 50kOhm package.
 
 Analog Devices datasheet: https://www.analog.com/media/en/technical-documentation/data-sheets/AD5253_5254.pdf
 """
+import os
+import threading
+
 import smbus2
 
 from awesem import is_machine_raspberry_pi
 from loguru import logger
 
+class I2CWriteQueue(object):
+    """Writes wiper positions from a background thread.
+
+    Only the latest requested databyte per (device, RDAC) is kept, so values requested
+    faster than the bus can write them (ie. while dragging a slider) are dropped. All
+    pending RDACs are written in a single bus transaction.
+
+    A shadow copy of each RDAC register holds the last databyte written to (or read from)
+    the device, so requests that wouldn't change the wiper position cause no bus traffic.
+    Requests are compared with the shadow by the writer thread, right before writing, so
+    a write in progress is never mistaken for the wiper position.
+
+    The shadow is per process, so all writes should go through one process (see
+    ImageScanProcess.set_scan_amplitude).
+    """
+    def __init__(self, i2c_bus=None, verify_writes=False):
+        """
+        Args:
+            i2c_bus (smbus2.SMBus, optional): Bus to write to. Defaults to None (ie.
+            writes are mocked).
+            verify_writes (bool, optional): Whether to read back each RDAC after writing
+            it. Defaults to False.
+        """
+        self._i2c_bus = i2c_bus
+        self._bus_lock = threading.Lock()
+        self._condition = threading.Condition()
+        self._pending = {}   # (device_addr, formatted_rdac_addr) -> databyte
+        self._shadow = {}    # (device_addr, formatted_rdac_addr) -> databyte
+        self._is_writing = False
+
+        self.verify_writes = verify_writes
+
+        self._thread = threading.Thread(target=self._thread_write, name="I2CWriteQueue")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def shadow_registers(self) -> dict:
+        """Last known databyte per (device, RDAC register). RDACs which haven't been
+        written or read yet are missing.
+        """
+        with self._condition:
+            return dict(self._shadow)
+
+    def put(self, device_addr:int, formatted_rdac_addr:int, databyte:int):
+        """Requests a databyte to be written. Replaces any pending databyte of the RDAC.
+        Databytes matching the wiper position are skipped by the writer thread.
+        """
+        key = (device_addr, formatted_rdac_addr)
+
+        with self._condition:
+            self._pending[key] = databyte
+            self._condition.notify_all()
+
+    def flush(self, timeout:float=None) -> bool:
+        """Waits until all pending databytes are written.
+
+        Returns:
+            bool: False if the timeout expired
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending and not self._is_writing,
+                timeout=timeout
+            )
+
+    def read(self, device_addr:int, formatted_rdac_addr:int) -> int:
+        """Reads the databyte of an RDAC from the device, and updates its shadow register.
+
+        Returns:
+            int: Databyte, or None if it couldn't be read
+        """
+        key = (device_addr, formatted_rdac_addr)
+
+        if self._i2c_bus is None:
+            with self._condition:
+                return self._shadow.get(key)
+
+        try:
+            databyte = self._read(device_addr, formatted_rdac_addr)
+        except OSError:
+            logger.exception(f"Error reading device {device_addr}, RDAC register {formatted_rdac_addr}")
+            return None
+
+        with self._condition:
+            self._shadow[key] = databyte
+
+        return databyte
+
+    def _read(self, device_addr:int, formatted_rdac_addr:int) -> int:
+        # Select the RDAC with the instruction byte, then read its databyte
+        write = smbus2.i2c_msg.write(device_addr, [formatted_rdac_addr])
+        read = smbus2.i2c_msg.read(device_addr, 1)
+
+        with self._bus_lock:
+            self._i2c_bus.i2c_rdwr(write, read)
+
+        return list(read)[0]
+
+    def _thread_write(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+
+                # Take everything requested so far, and skip what's already written. The
+                # shadow is up to date here, since only this thread writes.
+                writes = {
+                    key: databyte for key, databyte in self._pending.items()
+                    if self._shadow.get(key) != databyte
+                }
+                self._pending = {}
+                self._is_writing = True
+
+            try:
+                if writes:
+                    written = self._write(writes)
+
+                    with self._condition:
+                        self._shadow.update(written)
+            except Exception:
+                # Keep the thread alive, otherwise every later write would be dropped
+                logger.exception(f"Error writing {writes} to the digital potentiometers")
+            finally:
+                with self._condition:
+                    self._is_writing = False
+                    self._condition.notify_all()
+
+    def _write(self, writes:dict) -> dict:
+        """Writes the databytes in one combined transaction (ie. one message per RDAC)
+
+        The messages are joined by repeated starts, with a single STOP at the end,
+        instead of one STOP-terminated write per RDAC.
+
+        Returns:
+            dict: Databytes the devices hold after the write
+        """
+        if self._i2c_bus is None:
+            for (device_addr, formatted_rdac_addr), databyte in writes.items():
+                logger.info(f"Mock: Device {device_addr}, RDAC register {formatted_rdac_addr}, Databyte {databyte}")
+            return writes
+
+        messages = [
+            smbus2.i2c_msg.write(device_addr, [formatted_rdac_addr, databyte])
+            for (device_addr, formatted_rdac_addr), databyte in writes.items()
+        ]
+
+        try:
+            with self._bus_lock:
+                self._i2c_bus.i2c_rdwr(*messages)
+        except OSError:
+            logger.exception(f"Error writing {writes} to the digital potentiometers")
+            return {}
+
+        if not self.verify_writes:
+            return writes
+
+        written = {}
+        for (device_addr, formatted_rdac_addr), databyte in writes.items():
+            try:
+                read_back = self._read(device_addr, formatted_rdac_addr)
+            except OSError:
+                logger.exception(f"Error verifying device {device_addr}, RDAC register {formatted_rdac_addr}")
+                continue
+
+            if read_back != databyte:
+                logger.warning(f"Device {device_addr}, RDAC register {formatted_rdac_addr} reads {read_back} instead of {databyte}")
+
+            written[(device_addr, formatted_rdac_addr)] = read_back
+
+        return written
+
+
 class DigitalPotentiometers:
     """
     A class to communicate with the AD5263 Quad 256-Position I2C
@@ -43,11 +218,29 @@ class DigitalPotentiometers:
     RDAC3 = 2
     RDAC4 = 3
 
-    def __init__(self):
-        if is_machine_raspberry_pi():
-            self.i2c_bus = smbus.SMBus(1)
-        else:
-            logger.info("Mock: Initialized")
+    # Shared by all instances, since they're all on the same bus
+    _write_queue = None
+    _write_queue_lock = threading.Lock()
+
+    DEVICE_ADDRESSES = (DEVICE_ADDRESS_1, DEVICE_ADDRESS_2)
+    RDAC_ADDRESSES = (RDAC1, RDAC2, RDAC3, RDAC4)
+
+    def __init__(self, verify_writes:bool=None):
+        """
+        Args:
+            verify_writes (bool, optional): Whether to read back each RDAC after writing
+            it. Applies to all instances. Defaults to None (ie. unchanged).
+        """
+        with DigitalPotentiometers._write_queue_lock:
+            if DigitalPotentiometers._write_queue is None:
+                if is_machine_raspberry_pi():
+                    DigitalPotentiometers._write_queue = I2CWriteQueue(smbus2.SMBus(1))
+                else:
+                    DigitalPotentiometers._write_queue = I2CWriteQueue()
+                    logger.info("Mock: Initialized")
+
+        if verify_writes is not None:
+            self._write_queue.verify_writes = verify_writes
 
     def set_device1_amplitude(self, rdac_addr:int, amplitude_out: float):
         self._set_amplitude(self.DEVICE_ADDRESS_1, rdac_addr, amplitude_out)
@@ -55,26 +248,70 @@ class DigitalPotentiometers:
     def set_device2_amplitude(self, rdac_addr:int, amplitude_out: float):
         self._set_amplitude(self.DEVICE_ADDRESS_2, rdac_addr, amplitude_out)
 
+    def set_device1_amplitudes(self, amplitudes:dict):
+        """Sets several RDACs of device 1, which are written in the same transaction.
+
+        Args:
+            amplitudes (dict): Amplitude configured by user per RDAC address
+        """
+        for rdac_addr, amplitude_out in amplitudes.items():
+            self._set_amplitude(self.DEVICE_ADDRESS_1, rdac_addr, amplitude_out)
+
+    def flush(self, timeout:float=None) -> bool:
+        """Waits until all requested amplitudes are written to the devices.
+
+        Returns:
+            bool: False if the timeout expired
+        """
+        return self._write_queue.flush(timeout)
+
+    def read_wiper_positions(self):
+        """Reads all RDACs from the devices, so the shadow registers match the hardware
+        (ie. after start-up). Later writes of the same positions are then skipped.
+        """
+        for device_addr in self.DEVICE_ADDRESSES:
+            for rdac_addr in self.RDAC_ADDRESSES:
+                self._write_queue.read(device_addr, self._format_device_addr(rdac_addr))
+
+    def get_wiper_positions(self) -> list:
+        """Returns the last known wiper position of each RDAC, without any bus traffic.
+
+        Returns:
+            list: Dicts with the device and RDAC addresses, the databyte and the output
+            amplitude it corresponds to. Unknown positions are None.
+        """
+        shadow_registers = self._write_queue.shadow_registers
+
+        wiper_positions = []
+        for device_addr in self.DEVICE_ADDRESSES:
+            for rdac_addr in self.RDAC_ADDRESSES:
+                databyte = shadow_registers.get((device_addr, self._format_device_addr(rdac_addr)))
+
+                wiper_positions.append({
+                    "device": device_addr,
+                    "rdac": rdac_addr,
+                    "databyte": databyte,
+                    "amplitude": None if databyte is None else self._calculate_amplitude(self.AMPLITUDE_INPUT_VOLTS, databyte),
+                })
+
+        return wiper_positions
+
     def _set_amplitude(self, device_addr:int, rdac_addr:int, amplitude_out: float):
         """Given the amplitude of a wave, set the voltage divider to obtain the desired output amplitude.
 
+        The value is written by a background thread, so this returns immediately.
+
         Args:
             device_addr (int): Address of AD5263 pacakge
             rdac_addr (int): Address of specifc RDAC on the AD5263 package range [0,3]
             amplitude_in (float): Amplitude of input waveform
             amplitude_out (float): Amplitude configured by user
         """
-        if is_machine_raspberry_pi():
-            formatted_rdac_addr = self._format_device_addr(rdac_addr)
-            databyte = self._calculate_databyte(self.AMPLITUDE_INPUT_VOLTS, amplitude_out)
-
-            try:
-                self.i2c_bus.write_i2c_block_data(device_addr, formatted_rdac_addr, [databyte])
-            except OSError:
-                logger.exception(f"Error writing {amplitude_out} to device {device_addr}, rdac_addr {rdac_addr}")
+        formatted_rdac_addr = self._format_device_addr(rdac_addr)
+        databyte = self._calculate_databyte(self.AMPLITUDE_INPUT_VOLTS, amplitude_out)
 
-        else:
-            logger.info(f"Mock: Device {device_addr}, RDAC {rdac_addr}, Amplitude {amplitude_out}")
+        logger.trace(f"Device {device_addr}, RDAC {rdac_addr}, Amplitude {amplitude_out}")
+        self._write_queue.put(device_addr, formatted_rdac_addr, databyte)
 
     def _format_device_addr(self,device_addr_decimal:int) -> int:
         """Formats the device RDAC address to write to register through i2c.
@@ -111,6 +348,28 @@ class DigitalPotentiometers:
 
         return round(data)
 
+    def _calculate_amplitude(self, amplitude_in: float, databyte: int) -> float:
+        """Calculate the output amplitude of a databyte (ie. the inverse of
+        _calculate_databyte)
+
+        Args:
+            amplitude_in (float): Amplitude of input waveform
+            databyte (int): Databyte value ranging from 0 to 255
+
+        Returns:
+            float: Output amplitude
+        """
+        return (databyte + 1) / self.NUM_POSITIONS * amplitude_in
+
+def _reset_write_queue():
+    # The write thread doesn't survive a fork (ie. the image scan reader process), so the
+    # child starts its own queue
+    DigitalPotentiometers._write_queue = None
+    DigitalPotentiometers._write_queue_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_write_queue)
+
 if __name__ == "__main__":
     import time
 
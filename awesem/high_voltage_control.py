@@ -87,16 +87,43 @@ class HighVoltageControl:
         Returns:
             float: Ultravolt output load current (in amps)
         """
+        return self.get_ultravolt_output(num_samples=1, use_microamps=use_microamps)["current"]
 
-        set_voltage = self.get_ultravolt_voltage()
-        current_voltage_readout = self.adc.read_voltage(self.ADC_CHANNEL_ULTRAVOLT_CURRENT)
+    def get_ultravolt_output(self, num_samples=16, use_kilovolts=False, use_microamps=False) -> dict:
+        """Obtain averaged output voltage and current from one burst of interleaved ADC
+        readings, so both are sampled at the same time.
 
-        current = current_voltage_readout / self.CURRENT_RESISTOR_1_OHM - set_voltage / self.CURRENT_RESISTOR_2_OHM
+        Args:
+            num_samples (int, optional): Number of samples to average. Defaults to 16.
+            use_kilovolts (bool, optional): If true, returns the voltage in kilovolts
+            instead of volts. Defaults to False.
+            use_microamps (bool, optional): If true, returns the current in microamps
+            instead of amps. Defaults to False.
+
+        Returns:
+            dict: Mean and standard deviation of the voltage and current (ie. keys
+            voltage, voltage_std, current, current_std)
+        """
+        readouts = self.adc.read_samples(
+            (self.ADC_CHANNEL_ULTRAVOLT_VOLTAGE, self.ADC_CHANNEL_ULTRAVOLT_CURRENT),
+            num_samples
+        )
+
+        voltage = readouts[:, 0] * self.HV_READOUT_DIVIDER
+        current = readouts[:, 1] / self.CURRENT_RESISTOR_1_OHM - voltage / self.CURRENT_RESISTOR_2_OHM
+
+        if use_kilovolts:
+            voltage = voltage / 1000
 
         if use_microamps:
             current = current * 1e6
 
-        return current
+        return {
+            "voltage": float(voltage.mean()),
+            "voltage_std": float(voltage.std()),
+            "current": float(current.mean()),
+            "current_std": float(current.std()),
+        }
 
 if __name__=="__main__":
     import time
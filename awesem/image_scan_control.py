@@ -1,4 +1,6 @@
+import os
 import time
+import select
 import numpy as np
 from serial import Serial
 from enum import Enum
@@ -7,6 +9,7 @@ from aenum import Constant
 from loguru import logger
 
 from awesem import is_machine_raspberry_pi
+from awesem.log_aggregator import LogAggregator
 from awesem.drivers.digital_potentiometers import DigitalPotentiometers
 
 class Commands(Constant):
@@ -31,6 +34,33 @@ class ImageScanControl(object):
     CONTROL_BAUDRATE = 115200
 
     def __init__(self):
+        self._connect()
+
+        self._slow_axis_frequency_hz = None
+        self._fast_axis_frequency_hz = None
+        self._sampling_frequency_hz = None
+
+        self._expected_bytes_per_row = None
+
+        # Preallocated buffer for zero-copy ingest (see allocate_ring_buffer)
+        self._ring_buffer = None
+        self._ring_rows = None
+        self._ring_index = 0
+
+        # Short reads can repeat on every row, so they're summarized instead
+        self._short_read_log = LogAggregator()
+
+        # Keep track of frequencies since one command is used to set all 4 channels
+        self._beam_slow_axis_freq_hz = 0
+        self._beam_fast_axis_freq_hz = 0
+        self._stage_slow_axis_freq_hz = 0
+        self._stage_fast_axis_freq_hz = 0
+        self._sampling_frequency_hz = 0
+
+    def _connect(self):
+        """Connects to the Teensy's data and control serial ports, and the digital
+        potentiometers controlling the scan amplitude.
+        """
         try:
             self._serial_data = Serial(self.DATA_DEVICE_NAME, self.DATA_BAUDRATE, timeout=self.DATA_TIMEOUT_SEC)
             logger.debug(f"Connected to {self.DATA_DEVICE_NAME}")
@@ -46,19 +76,6 @@ class ImageScanControl(object):
 
         self._digital_pots = DigitalPotentiometers()
 
-        self._slow_axis_frequency_hz = None
-        self._fast_axis_frequency_hz = None
-        self._sampling_frequency_hz = None
-
-        self._expected_bytes_per_row = None
-
-        # Keep track of frequencies since one command is used to set all 4 channels
-        self._beam_slow_axis_freq_hz = 0
-        self._beam_fast_axis_freq_hz = 0
-        self._stage_slow_axis_freq_hz = 0
-        self._stage_fast_axis_freq_hz = 0
-        self._sampling_frequency_hz = 0
-
     def _are_params_set(self) -> bool:
         """Check if parameters are set by the user. These are required to calculate things
         like image resolution and the expected bytes per full image scan.
@@ -121,6 +138,56 @@ class ImageScanControl(object):
         """
         return (self.data_buffer_resolution[0], int(self.data_buffer_resolution[1]/2))
 
+    @property
+    def ring_buffer(self) -> np.ndarray:
+        """Returns the ring buffer used for zero-copy ingest (one row per read), or None
+        if it has not been allocated.
+        """
+        if self._ring_buffer is None:
+            return None
+
+        return self._ring_buffer[:-1]
+
+    def allocate_ring_buffer(self, buffer=None) -> np.ndarray:
+        """Preallocates a frame-sized ring buffer for zero-copy ingest.
+
+        Once allocated, read_data reads each row straight from the serial port's file
+        descriptor into the next slot of the ring buffer (see _readinto_serial) and returns
+        a view of that slot instead of allocating a new array per row. The read position
+        is rewound at the start of every scan, so the ring buffer holds the raw rows of one
+        full scan in the order they were received. Rows received past the end of the scan
+        are read into a spare slot so they never overwrite the scan data.
+
+        The ring buffer has to be reallocated whenever the axis or sampling frequencies
+        change.
+
+        Args:
+            buffer (optional): Writable memory to back the ring buffer with (ie. shared
+            memory). Must hold at least (rows + 1) * bytes per row. Defaults to a new
+            bytearray.
+
+        Returns:
+            np.ndarray: Ring buffer of shape (rows per scan, bytes per row)
+        """
+        if not self._are_params_set():
+            logger.error("Could not allocate ring buffer with missing information.")
+            return None
+
+        bytes_per_row, rows = self.data_buffer_resolution
+        shape = (rows + 1, bytes_per_row)
+
+        if buffer is None:
+            buffer = bytearray(shape[0] * shape[1])
+
+        self._ring_buffer = np.frombuffer(buffer, dtype=np.uint8, count=shape[0] * shape[1]).reshape(shape)
+        # Keep one memoryview per slot so reads don't have to create them on the fly
+        self._ring_rows = [memoryview(row) for row in self._ring_buffer]
+        self._ring_index = 0
+
+        logger.debug(f"Allocated ring buffer with {rows} rows of {bytes_per_row} bytes")
+
+        return self.ring_buffer
+
     def set_axis_frequency(self, component:str, slow_axis:float, fast_axis:float, sampling_frequency_hz:float):
         if component == "stage":
             self._stage_fast_axis_freq_hz = fast_axis
@@ -156,10 +223,10 @@ class ImageScanControl(object):
         logger.info(f"Sampling frequency set to {sampling_freq_hz} Hz")
 
     def set_scan_amplitude(self, value:float):
-        # Fast axis amplitude
-        self._digital_pots.set_device1_amplitude(self._digital_pots.RDAC2, value)
-        # Slow axis amplitude
-        self._digital_pots.set_device1_amplitude(self._digital_pots.RDAC4, value)
+        self._digital_pots.set_device1_amplitudes({
+            self._digital_pots.RDAC2: value,   # Fast axis amplitude
+            self._digital_pots.RDAC4: value,   # Slow axis amplitude
+        })
 
         logger.info(f"Set fast and slow axis amplitudes to {value} V")
 
@@ -167,10 +234,19 @@ class ImageScanControl(object):
         """Stops the image Scan
         """
 
-        self._serial_control.write(Commands.STOP_SCAN)
-        logger.debug("Stopped Teensy")
+        if self._serial_control:
+            self._serial_control.write(Commands.STOP_SCAN)
+            logger.debug("Stopped Teensy")
+        else:
+            logger.info("Mock: Stopping scan")
 
 
+    def discard_pending_data(self):
+        """Discards data received but not read yet (ie. the rest of a stopped scan)
+        """
+        if self._serial_data:
+            self._serial_data.reset_input_buffer()
+
     def start_scan(self, calibration_mode=False):
         """Starts the image scan. Exits if required parameters are not set.
         """
@@ -191,6 +267,7 @@ class ImageScanControl(object):
             logger.info("Mock: Starting scan")
 
         self._expected_bytes_per_row = self.data_buffer_resolution[0]
+        self._ring_index = 0
         bytes_per_image_rounded = int(self.data_buffer_resolution[0] * self.data_buffer_resolution[1])
 
         logger.debug(f"Expected bytes per image (rounded): {bytes_per_image_rounded} bytes")
@@ -203,8 +280,12 @@ class ImageScanControl(object):
         data for a full image scan.
 
         Returns:
-            np.ndarray: Numpy array of fast axis length, casted from bytes to uint8
+            np.ndarray: Numpy array of fast axis length, casted from bytes to uint8. If the
+            ring buffer is allocated, this is a view of the ring buffer slot the row was
+            read into.
         """
+        if self._ring_buffer is not None:
+            return self._read_data_into_ring()
 
         if self._serial_data:
             buf = self._serial_data.read(self._expected_bytes_per_row)
@@ -214,13 +295,77 @@ class ImageScanControl(object):
             return np.random.randint(255, size=(self._expected_bytes_per_row))
 
         if len(buf) == 0:
+            self._short_read_log.flush()
             logger.warning(f"No bytes received.")
             return None
         else:
             if len(buf) != self._expected_bytes_per_row:
-                logger.warning(f"Only received {len(buf)} bytes, but expected {self._expected_bytes_per_row} bytes")
+                self._short_read_log.log("Only received {} bytes, but expected {} bytes", len(buf), self._expected_bytes_per_row)
             return np.frombuffer(buf, dtype=np.uint8)
 
+    def _read_data_into_ring(self) -> np.ndarray:
+        """Read a row of data from serial straight into the next slot of the ring buffer.
+
+        Returns:
+            np.ndarray: View of the ring buffer slot holding the received bytes
+        """
+        # The last slot is spare, and is reused for any data past the end of the scan
+        slot = min(self._ring_index, len(self._ring_rows) - 1)
+        self._ring_index += 1
+
+        if self._serial_data:
+            num_bytes = self._readinto_serial(self._ring_rows[slot])
+        else:
+            # Generate random noise
+            time.sleep(0.01)
+            num_bytes = self._ring_buffer.shape[1]
+            self._ring_buffer[slot] = np.random.randint(255, size=num_bytes)
+
+        if num_bytes == 0:
+            self._short_read_log.flush()
+            logger.warning("No bytes received.")
+            return None
+        else:
+            if num_bytes != self._expected_bytes_per_row:
+                self._short_read_log.log("Only received {} bytes, but expected {} bytes", num_bytes, self._expected_bytes_per_row)
+            return self._ring_buffer[slot, :num_bytes]
+
+    def _readinto_serial(self, view:memoryview) -> int:
+        """Reads from the data port into the view until it's full or the read times out,
+        like Serial.read.
+
+        pyserial's readinto calls read and copies the returned bytes, so on POSIX the port's
+        file descriptor is read directly (with readv) instead. Elsewhere (ie. no file
+        descriptor) this falls back to pyserial's readinto, which isn't zero-copy.
+
+        Returns:
+            int: Number of bytes read
+        """
+        fd = getattr(self._serial_data, "fd", None)
+        if fd is None:
+            return self._serial_data.readinto(view)
+
+        timeout = self._serial_data.timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        num_bytes = 0
+
+        while num_bytes < len(view):
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                break
+
+            try:
+                read = os.readv(fd, [view[num_bytes:]])
+            except (BlockingIOError, InterruptedError):
+                continue
+            if read == 0:
+                # Readable with no data means the device was disconnected
+                break
+            num_bytes += read
+
+        return num_bytes
+
 if __name__ == "__main__":
     scan_control = ImageScanControl()
 
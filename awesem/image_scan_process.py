@@ -0,0 +1,371 @@
+"""
+Image Scan Process
+==================
+
+Runs the image scan control in a dedicated process, so the UART data stream is drained
+independently of the web app (ie. the Flask request threads, the image encoder and the
+frame thread never hold up a serial read).
+
+Rows are read by the reader process straight into a ring buffer in shared memory. Only
+the lengths of the rows are sent back through a queue, in batches, so the web process
+maps the scan data instead of copying it and the queue isn't used for every row.
+
+The ring buffer is sized for the frequencies the scan was started with, so changing the
+axis or sampling frequencies ends the running scan. The next scan is started with a ring
+buffer of the new size.
+
+The reader process is forked, so the web app isn't imported again by the child. Only the
+forking thread survives a fork, so start_reader_process should be called before any
+threads are created (ie. before the log sinks and the hardware handlers of the web app).
+
+Note: Requires python 3.8 or greater (for multiprocessing.shared_memory).
+"""
+import time
+import queue
+import threading
+import atexit
+import collections
+import multiprocessing
+
+from loguru import logger
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+from awesem.image_scan_control import ImageScanControl
+from awesem.drivers.digital_potentiometers import DigitalPotentiometers
+
+# Row lengths are published once this many rows were read, or once the oldest unpublished
+# row is this old, whichever comes first
+ROWS_PER_BATCH = 64
+BATCH_INTERVAL_SEC = 0.01
+
+# Commands which end a running scan. Frequency changes alter the size of the rows, so
+# they can't share the scan's ring buffer.
+SCAN_ENDING_COMMANDS = ("stop_scan", "start_scan", "close", "set_axis_frequency", "set_sampling_frequency")
+
+# (process, commands queue, rows queue) of the reader process, once started
+_reader = None
+
+def _release_shared_memory(memories:list) -> list:
+    """Closes shared memory that is no longer used. Memory which is still referenced
+    (ie. by a numpy view that hasn't been garbage collected yet) is kept for later.
+
+    Args:
+        memories (list): Retired shared memory objects
+
+    Returns:
+        list: Shared memory objects which could not be closed yet
+    """
+    still_in_use = []
+
+    for memory in memories:
+        try:
+            memory.close()
+        except BufferError:
+            still_in_use.append(memory)
+
+    return still_in_use
+
+def _execute(scan_control:ImageScanControl, name:str, args:tuple):
+    """Executes a command which doesn't affect the state of a running scan
+    """
+    if name == "set_axis_frequency":
+        scan_control.set_axis_frequency(*args)
+    elif name == "set_sampling_frequency":
+        scan_control.set_sampling_frequency(*args)
+    elif name == "stop_scan":
+        scan_control.stop_scan()
+    else:
+        logger.error(f"Unknown command '{name}'")
+
+def _run_reader_process(commands: multiprocessing.Queue, rows: multiprocessing.Queue):
+    """Main loop of the reader process. Owns the hardware and executes the commands sent
+    by ImageScanProcess.
+
+    While scanning, each row is read into the shared ring buffer and the row lengths are
+    published in batches as (scan id, [number of bytes, ...]). A length of 0 marks the
+    end of the scan.
+
+    Args:
+        commands (multiprocessing.Queue): (command, args) tuples sent by the web process
+        rows (multiprocessing.Queue): Published (scan id, list of row lengths) tuples
+    """
+    scan_control = ImageScanControl()
+    ring_memory = None
+    retired_memories = []
+    command = None
+
+    while True:
+        if command is None:
+            command = commands.get()
+
+        name, args = command
+        command = None
+
+        try:
+            if name == "close":
+                break
+            elif name == "start_scan":
+                scan_id, memory_name, calibration_mode = args
+
+                if ring_memory is None or ring_memory.name != memory_name:
+                    if ring_memory is not None:
+                        retired_memories.append(ring_memory)
+
+                    ring_memory = shared_memory.SharedMemory(name=memory_name)
+                    # The web process owns the shared memory and unlinks it, so don't let
+                    # this process' resource tracker clean it up as well
+                    resource_tracker.unregister(ring_memory._name, "shared_memory")
+
+                scan_control.allocate_ring_buffer(buffer=ring_memory.buf)
+                retired_memories = _release_shared_memory(retired_memories)
+
+                scan_control.start_scan(calibration_mode=calibration_mode)
+
+                row_lengths = []
+                batch_start_time = None
+
+                while True:
+                    # Other commands (ie. scan amplitude) are executed without interrupting
+                    # the scan, unless they end it
+                    try:
+                        command = commands.get_nowait()
+                    except queue.Empty:
+                        pass
+
+                    if command is not None:
+                        if command[0] in SCAN_ENDING_COMMANDS:
+                            if command[0] in ("set_axis_frequency", "set_sampling_frequency"):
+                                # The rest of the scan has rows of the old size
+                                scan_control.stop_scan()
+                                time.sleep(scan_control.DATA_TIMEOUT_SEC)
+                                scan_control.discard_pending_data()
+                            rows.put((scan_id, row_lengths + [0]))
+                            break
+
+                        _execute(scan_control, *command)
+                        command = None
+
+                    buffer = scan_control.read_data()
+
+                    if buffer is None:
+                        rows.put((scan_id, row_lengths + [0]))
+                        break
+
+                    if not row_lengths:
+                        batch_start_time = time.monotonic()
+                    row_lengths.append(len(buffer))
+
+                    if len(row_lengths) >= ROWS_PER_BATCH or time.monotonic() - batch_start_time >= BATCH_INTERVAL_SEC:
+                        rows.put((scan_id, row_lengths))
+                        row_lengths = []
+            else:
+                _execute(scan_control, name, args)
+        except:
+            logger.exception(f"Reader process could not execute '{name}'")
+
+    logger.debug("Reader process terminated.")
+
+def start_reader_process() -> tuple:
+    """Forks the reader process, unless it's already running. Call this before any threads
+    are created, since a lock held by another thread at the time of the fork (ie. by a
+    log sink or an I2C write thread) stays locked forever in the child.
+
+    Returns:
+        tuple: (process, commands queue, rows queue) of the reader process
+    """
+    global _reader
+
+    if _reader is not None:
+        return _reader
+
+    if threading.active_count() > 1:
+        logger.warning(
+            f"Forking the reader process with {threading.active_count()} threads running. "
+            "It should be started before any threads are created."
+        )
+
+    context = multiprocessing.get_context("fork")
+    commands = context.Queue()
+    rows = context.Queue()
+
+    process = context.Process(
+        target=_run_reader_process,
+        args=(commands, rows),
+        name="ImageScanReader"
+    )
+    process.daemon = True
+    process.start()
+    logger.info(f"Started reader process with pid {process.pid}")
+
+    _reader = (process, commands, rows)
+    return _reader
+
+class ImageScanProcess(ImageScanControl):
+    """Drop-in replacement for ImageScanControl which runs the image scan control in its
+    own process.
+
+    Parameters are mirrored locally so resolutions can be calculated without asking the
+    reader process. read_data returns views of the shared ring buffer.
+    """
+    # Only used if the reader process dies, since it marks the end of each scan itself
+    ROW_TIMEOUT_SEC = 10 * ImageScanControl.DATA_TIMEOUT_SEC
+
+    @staticmethod
+    def is_supported() -> bool:
+        """Returns true if shared memory is available (python 3.8 or greater)
+        """
+        return shared_memory is not None
+
+    def _connect(self):
+        """Starts the reader process (unless start_reader_process was called already),
+        which connects to the hardware instead.
+        """
+        self._serial_data = None
+        self._serial_control = None
+        # The pots are on I2C rather than the UART, so they're written from this process.
+        # This keeps a single owner of the pots' shadow registers (ie. for the web app's
+        # wiper positions).
+        self._digital_pots = DigitalPotentiometers()
+
+        self._ring_memory = None
+        self._retired_memories = []
+        self._scan_id = 0
+        self._scan_running = False
+        self._row_lengths = collections.deque()   # published, but not read yet
+
+        self._process, self._commands, self._rows = start_reader_process()
+
+        atexit.register(self.close)
+
+    def _send_command(self, name:str, *args):
+        self._commands.put((name, args))
+
+    def close(self):
+        """Stops the reader process and releases the shared ring buffer
+        """
+        if self._process.is_alive():
+            self._send_command("close")
+            self._process.join(timeout=1)
+
+        if self._ring_memory is not None:
+            self._ring_memory.unlink()
+            self._ring_memory = None
+
+    def allocate_ring_buffer(self, buffer=None):
+        """Preallocates the ring buffer in shared memory. See
+        ImageScanControl.allocate_ring_buffer.
+        """
+        if buffer is not None:
+            return super().allocate_ring_buffer(buffer)
+
+        if not self._are_params_set():
+            logger.error("Could not allocate ring buffer with missing information.")
+            return None
+
+        bytes_per_row, rows = self.data_buffer_resolution
+
+        # The reader process keeps its mapping of the previous buffer until the next scan
+        # starts, so it's safe to unlink it here
+        if self._ring_memory is not None:
+            self._ring_memory.unlink()
+            self._retired_memories.append(self._ring_memory)
+
+        self._ring_memory = shared_memory.SharedMemory(create=True, size=(rows + 1) * bytes_per_row)
+        ring_buffer = super().allocate_ring_buffer(self._ring_memory.buf)
+
+        self._retired_memories = _release_shared_memory(self._retired_memories)
+
+        return ring_buffer
+
+    def _end_running_scan(self):
+        """Ends the running scan before its frequencies change (the reader process ends
+        it as well). read_data returns None from now on, until the next scan is started
+        with a ring buffer sized for the new frequencies.
+        """
+        if self._scan_running:
+            logger.info("Ending the running scan, since its frequencies are changing")
+            self._scan_running = False
+
+    def set_axis_frequency(self, component:str, slow_axis:float, fast_axis:float, sampling_frequency_hz:float):
+        self._end_running_scan()
+
+        if component == "stage":
+            self._sampling_frequency_hz = sampling_frequency_hz
+        elif component != "beam":
+            logger.error(f"{component} not allowed. Please select 'beam' or 'stage'.")
+            return None
+
+        self._send_command("set_axis_frequency", component, slow_axis, fast_axis, sampling_frequency_hz)
+
+        self._slow_axis_frequency_hz = slow_axis
+        self._fast_axis_frequency_hz = fast_axis
+
+        logger.info(f"Stage axis frequency set to {slow_axis} Hz and {fast_axis} Hz")
+
+    def set_sampling_frequency(self, sampling_freq_hz:float):
+        self._end_running_scan()
+        self._send_command("set_sampling_frequency", sampling_freq_hz)
+        super().set_sampling_frequency(sampling_freq_hz)
+
+    def stop_scan(self):
+        self._send_command("stop_scan")
+
+    def start_scan(self, calibration_mode=False):
+        """Starts the image scan in the reader process. Exits if required parameters are
+        not set.
+        """
+        if not self._are_params_set():
+            logger.error("Scan not started.")
+            return None
+
+        bytes_per_row, rows = self.data_buffer_resolution
+        if self._ring_buffer is None or self._ring_buffer.shape != (rows + 1, bytes_per_row):
+            self.allocate_ring_buffer()
+
+        self._scan_id += 1
+        self._expected_bytes_per_row = bytes_per_row
+        self._ring_index = 0
+        self._row_lengths.clear()
+        self._scan_running = True
+
+        self._send_command("start_scan", self._scan_id, self._ring_memory.name, calibration_mode)
+
+    def read_data(self):
+        """Waits for the next row published by the reader process.
+
+        Returns:
+            np.ndarray: View of the shared ring buffer slot holding the row, or None at
+            the end of the scan
+        """
+        while not self._row_lengths:
+            if not self._scan_running:
+                return None
+
+            try:
+                scan_id, row_lengths = self._rows.get(timeout=self.ROW_TIMEOUT_SEC)
+            except queue.Empty:
+                logger.warning("Reader process did not publish any rows.")
+                self._scan_running = False
+                return None
+
+            # Drop rows left over from a previous scan
+            if scan_id == self._scan_id:
+                self._row_lengths.extend(row_lengths)
+
+        # The frequencies may have changed while waiting, and with them the ring buffer
+        if not self._scan_running:
+            return None
+
+        num_bytes = self._row_lengths.popleft()
+        if num_bytes == 0:
+            self._scan_running = False
+            return None
+
+        slot = min(self._ring_index, len(self._ring_rows) - 1)
+        self._ring_index += 1
+
+        return self._ring_buffer[slot, :num_bytes]
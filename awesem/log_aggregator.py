@@ -0,0 +1,74 @@
+import time
+import threading
+
+from loguru import logger
+
+class LogAggregator(object):
+    """Logs a message which may repeat on every row (ie. a short row warning) at most
+    once per interval. Repeats within the interval are counted, and logged as a single
+    summary once the interval has passed or the aggregator is flushed (ie. at the end of
+    a scan).
+    """
+    def __init__(self, level:str="WARNING", interval_sec:float=5.0):
+        """
+        Args:
+            level (str, optional): Level of the messages. Defaults to "WARNING".
+            interval_sec (float, optional): Minimum time between logged messages.
+            Defaults to 5.0.
+        """
+        self.level = level
+        self.interval_sec = interval_sec
+
+        self._lock = threading.Lock()
+        self._last_log_time = None
+        self._suppressed = 0
+        self._last_message = None
+
+    def log(self, message:str, *args, **kwargs):
+        """Logs the message, unless a message was logged less than an interval ago.
+        Arguments are formatted lazily like loguru's (ie. "Received {} bytes").
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            if self._last_log_time is not None and now - self._last_log_time < self.interval_sec:
+                self._suppressed += 1
+                self._last_message = (message, args, kwargs)
+                return
+
+            suppressed = self._pop_suppressed(now)
+
+        if suppressed:
+            logger.opt(depth=1).log(self.level, "{} similar messages in the last {:.1f} sec", *suppressed)
+        logger.opt(depth=1).log(self.level, message, *args, **kwargs)
+
+    def flush(self):
+        """Logs a summary of the suppressed messages, if any"""
+        with self._lock:
+            suppressed = self._pop_suppressed(time.monotonic())
+            last_message = self._last_message
+            self._last_log_time = None
+
+        if suppressed:
+            message, args, kwargs = last_message
+            logger.opt(depth=1).log(
+                self.level,
+                "{} similar messages in the last {:.1f} sec, the last one was: " + message,
+                *suppressed, *args, **kwargs
+            )
+
+    def _pop_suppressed(self, now:float) -> tuple:
+        """Starts a new interval. Must hold the lock.
+
+        Returns:
+            tuple: Number of suppressed messages and the length of the interval, or None
+            if no message was suppressed
+        """
+        suppressed = None
+        if self._suppressed:
+            suppressed = (self._suppressed, now - self._last_log_time)
+
+        self._last_log_time = now
+        self._suppressed = 0
+
+        return suppressed
@@ -51,4 +51,7 @@ PIX_PER_UPDATE      = 25000
 DISP_PERIOD         = 1000 #?
 
 # Data Thread Stats
-BUFFLEN_DATA_TO_REGISTER    = 256
+MCU_PIPELINE_DEPTH          = 1 # Buffer requests kept in flight, 1 waits for each buffer before requesting the next
+BUFFLEN_DATA_TO_REGISTER    = 256 # Sample blocks queued between the data and register threads
+DATA_QUEUE_TIMEOUT          = 0.1 # Seconds, how often a data thread blocked on a full queue checks for halt
+THREAD_STOP_TIMEOUT         = 1.0 # Seconds closing the GUI waits for each of the data and register threads
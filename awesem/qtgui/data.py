@@ -13,6 +13,7 @@
 
 
 import time
+import queue
 import threading
 import numpy
 from   collections             import deque
@@ -22,24 +23,34 @@ import awesem.qtgui.constants        as     Const
 class DataIn(threading.Thread):
     """
     This class takes the input data and stores it in a queue.
-    This class houses a python timer thread (NOT QThread).
-    When called periodically it "polls" data points with
-    timestamps and adds them to the data queue to be
-    processed by the display thread.
+    This class houses a python thread (NOT QThread).
+    While commenced it requests sample blocks from the MCU and
+    adds them to the bounded data queue to be processed by the
+    register thread, it is the only producer of that queue.
+    While halted the thread blocks rather than polling.
 
     Polling based off of: https://stackoverflow.com/a/28034554
     """
     __OutQueue           = None
     __PollPeriod         = None
     __MCUInterface       = None
-    __DoSample           = False
+    __DoSample           = None
+    __Stopping           = None
     __InternalQueue      = deque(maxlen = 50)
     __InternalNumCollect = 0
 
     def __init__(self, MCUInterface, outputQueue):
+        """
+        Parameters:
+          'MCUInterface' AWESEM_PiPion_Interface to request sample blocks from.
+          'outputQueue'  Bounded queue.Queue the sample blocks are put in.
+        """
         threading.Thread.__init__(self)
+        self.daemon = True # Blocked waiting for commence() otherwise keeps the GUI from exiting
         self.__MCUInterface = MCUInterface
         self.__OutQueue     = outputQueue
+        self.__DoSample     = threading.Event()
+        self.__Stopping     = threading.Event()
 
     def setPollFrequency(self, newPollFrequency):
         self.__PollPeriod = 1.0 / float(newPollFrequency)
@@ -69,22 +80,28 @@ class DataIn(threading.Thread):
     """
 
     def run(self):
-        while True: # Feels bad, better than threading maybe?
-            if self.__DoSample or self.__InternalNumCollect > 0:
-                value = None
-                while value is None and self.__DoSample:
-                    value = self.__MCUInterface.getDataBuffer()
-                    if value is not None:
-                        #if self.justHalted < 4:
-                        #    self.justHalted = self.justHalted + 1
-                        #    if self.justHalted > 3:
-                        #        self.justHalted = 10
-                        #        print(value[0, :])
-                        if self.__InternalNumCollect > 0: # Happens if redirected by acquireNBuffers
-                            self.__InternalNumCollect = self.__InternalNumCollect - 1
-                            self.__InternalQueue.append(value)
-                        if self.__DoSample and self.__OutQueue is not None:
-                            self.__OutQueue.append(value)
+        while not self.__Stopping.is_set():
+            self.__DoSample.wait()
+            if self.__Stopping.is_set():
+                break
+            if not self.__MCUInterface.connectedToPion():
+                # Requests fail immediately while disconnected, blocks until reconnected or stopped
+                self.__MCUInterface.waitForConnection(cancelEvent = self.__Stopping)
+                continue
+            value = self.__MCUInterface.getDataBuffer() # Blocks until the buffer or the serial timeout
+            if value is None:
+                continue
+            if self.__InternalNumCollect > 0: # Happens if redirected by acquireNBuffers
+                self.__InternalNumCollect = self.__InternalNumCollect - 1
+                self.__InternalQueue.append(value)
+            if self.__OutQueue is not None:
+                # Blocks while the register thread catches up, gives up on the buffer if halted
+                while self.__DoSample.is_set() and not self.__Stopping.is_set():
+                    try:
+                        self.__OutQueue.put(value, timeout = Const.DATA_QUEUE_TIMEOUT)
+                        break
+                    except queue.Full:
+                        continue
 
     def acquireNBuffers(self, numBuffers):
         """
@@ -108,9 +125,18 @@ class DataIn(threading.Thread):
     def halt(self):
         """Stops acquiring sample blocks for continous streaming.
         """
-        self.__DoSample = False
+        self.__DoSample.clear()
 
     def commence(self):
         """Starts acquiring sample blocks for continuous streaming.
         """
-        self.__DoSample = True
+        self.__DoSample.set()
+
+    def stop(self):
+        """Ends the thread, returns once the current request is finished or
+        after Const.THREAD_STOP_TIMEOUT.
+        """
+        self.__Stopping.set()
+        self.__DoSample.set() # Wakes the thread if halted
+        self.__MCUInterface.interruptWaitForConnection() # Wakes the thread if disconnected
+        self.join(timeout = Const.THREAD_STOP_TIMEOUT)
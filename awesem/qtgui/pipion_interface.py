@@ -15,7 +15,9 @@ TODO:
 """
 # ----------------------- Imported Libraries ------------------------------------
 
-from   threading import Lock
+from   threading import RLock, Thread, Event, Condition
+from   collections import deque
+from   concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import struct
 import serial
 import numpy
@@ -24,6 +26,57 @@ from serial.tools import list_ports
 
 # ------------------------ Class Definition -------------------------------------
 
+class AWESEM_PiPion_DataBuffer:
+    """
+    A block of samples received from the PiPion.
+
+    Holds the raw samples (one byte each) and the timing of the block. Timestamps of
+    the individual samples are only generated when asked for, and are kept afterwards.
+
+    Note:
+        Offsets and duration are in microseconds, timestamps are in seconds.
+    """
+    __slots__ = ('packetID', 'aOffset', 'bOffset', 'duration', 'samples', '_aTimes', '_bTimes')
+
+    def __init__(self, packetID, aOffset, bOffset, duration, samples):
+        self.packetID = packetID
+        self.aOffset  = aOffset
+        self.bOffset  = bOffset
+        self.duration = duration
+        self.samples  = samples # uint8 array
+        self._aTimes  = None
+        self._bTimes  = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def aTimes(self):
+        """Timestamps of the samples relative to DAC a, in seconds.
+        """
+        if self._aTimes is None:
+            self._aTimes = numpy.linspace(self.aOffset, self.aOffset + self.duration, len(self.samples)) / 1000000.0
+        return self._aTimes
+
+    @property
+    def bTimes(self):
+        """Timestamps of the samples relative to DAC b, in seconds.
+        """
+        if self._bTimes is None:
+            self._bTimes = numpy.linspace(self.bOffset, self.bOffset + self.duration, len(self.samples)) / 1000000.0
+        return self._bTimes
+
+    def toArray(self):
+        """
+        Description:
+          Returns the buffer in the format previously returned by getDataBuffer.
+
+        Returns:
+          Float array of the form [bTimes, aTimes, samples] as column vectors.
+        """
+        return numpy.stack((self.bTimes, self.aTimes, self.samples), 1)
+
+
 class AWESEM_PiPion_Interface:
     """
     This class enables communication with the PiPion SEM
@@ -44,7 +97,11 @@ class AWESEM_PiPion_Interface:
     _currentlyScanning  = False
     _serialPort = None # Object for serial communication
     _lastPacketID = 0 # How many sample packets have been recieved
-    _guardLock    = Lock() # Had crashes when attempting to set parameters during reads
+    _missedPackets = 0 # Total gaps in the packet ids
+    _pipelineDepth = 1 # Buffer requests kept in flight, 1 waits for each buffer before requesting the next
+    _lastKnownPort = None # Device of the last port the PiPion answered on, tried first when reconnecting
+    _autoReconnect = True # Reconnects in the background when the link drops
+    _guardLock    = RLock() # Had crashes when attempting to set parameters during reads, reentrant since setters may load the history
 
     # Current values
 
@@ -56,14 +113,29 @@ class AWESEM_PiPion_Interface:
 
     # Constants
     _SERIAL_RECONNECTIONATTEMPTS = 1 # Number of times to try all ports once.
+    _SERIAL_RECONNECTIONINTERVAL = 1.0 # Seconds between background reconnection attempts
+    _SERIAL_USBIDS = ((0x16C0, 0x0483),) # USB (vendor, product) ids of the Teensy's serial port, probed before any other port
     _SERIAL_TIMEOUT = 0.1 # Timeout in seconds
     _SERIAL_DATASTRUCT_BUFFERSIZE = 1024 # Make sure that this is the same as specified in the MCU code
+    _SERIAL_DATASTRUCT_HEADER = struct.Struct('<cIIII') # Ack, packet id, a offset, b offset and duration
 
     # -------------------- Public Members ---------------
 
-    def __init__(self):
-        """Initializes communications over serial to the PiPion
+    def __init__(self, pipelineDepth = 1):
         """
+        Description:
+          Initializes communications over serial to the PiPion
+
+        Parameters:
+          'pipelineDepth' Buffer requests kept in flight (see setPipelineDepth).
+        """
+        self.setPipelineDepth(pipelineDepth)
+        self._expectedResponses = deque() # Requests sent but not answered yet, in order
+        self._buffersInFlight   = 0
+        self._receivedBuffers   = deque() # Buffers read while waiting on other responses
+        self._reconnectThread   = None
+        self._closing           = Event()
+        self._connectionChanged = Condition() # Notified when connecting, dropping the link or closing
         self.reconnectToPion()
         self._lastBlock = 0 # Tracks buffer count
         self.pauseEvents()  # Not trusting default state of PiPion
@@ -85,21 +157,83 @@ class AWESEM_PiPion_Interface:
         """
         self._verbose = enableVerbose
 
+    def setPipelineDepth(self, numRequests):
+        """
+        Description:
+          Sets the number of buffer requests kept in flight by getDataBuffer, so the
+          MCU can send the next buffer while the last one is processed. Responses are
+          read in the order they were requested and matched by packet id.
+
+        Parameters:
+          'numRequests' Requests in flight, 1 waits for each buffer (stop-and-wait).
+        """
+        if numRequests < 1:
+            return False
+        self._pipelineDepth = int(numRequests)
+        return True
+
+    def getMissedPackets(self):
+        """Returns the total number of packets skipped by the MCU (ie. gaps in the packet ids)
+        """
+        return self._missedPackets
+
+    def setAutoReconnect(self, enableReconnect):
+        """Enables reconnecting in the background when the link to the PiPion drops
+        """
+        self._autoReconnect = enableReconnect
+
     def connectedToPion(self):
         return self._currentlyConnected
 
+    def waitForConnection(self, timeout = None, cancelEvent = None):
+        """
+        Description:
+          Blocks until the PiPion is connected (ie. reconnected in the background),
+          the interface is closed or the wait is cancelled.
+
+        Parameters:
+          'timeout'     Seconds to wait at most, None waits indefinitely.
+          'cancelEvent' threading.Event that ends the wait once set, see
+                        interruptWaitForConnection.
+
+        Returns:
+          True if connected to the PiPion.
+        """
+        with self._connectionChanged:
+            self._connectionChanged.wait_for(lambda: self._currentlyConnected or self._closing.is_set()
+                                             or (cancelEvent is not None and cancelEvent.is_set()), timeout)
+            return self._currentlyConnected
+
+    def interruptWaitForConnection(self):
+        """Wakes threads in waitForConnection so they check their cancel event
+        """
+        with self._connectionChanged:
+            self._connectionChanged.notify_all()
+
     def reconnectToPion(self):
         """Attempts to reestablish connection with the PiPion
         """
-        if self._findPort():
-            self._currentlyConnected = True;
-            return True
-        return False
+        serialPort = self._findPort()
+        if serialPort is None:
+            return False
+        with self._guardLock:
+            if self._serialPort is not None:
+                self._serialPort.close()
+            self._serialPort = serialPort
+            self._expectedResponses.clear()
+            self._buffersInFlight = 0
+            self._receivedBuffers.clear()
+            self._lastPacketID = 0
+            self._setConnected(True)
+        return True
 
     def close(self):
         """Safely closes the connection to the PiPion.
         """
-        self._serialPort.close()
+        self._closing.set()
+        self.interruptWaitForConnection()
+        if self._serialPort is not None:
+            self._serialPort.close()
 
     def isScanning(self):
         return self._currentlyScanning
@@ -112,8 +246,7 @@ class AWESEM_PiPion_Interface:
          Returns:
            True if the MCU responds well, false otherwise.
         """
-        self._sendBytes(b'p')
-        return self._readBytes(1) == b'A'
+        return self._exchange(b'p', self._readAck) == b'A'
 
     def getBufferSize(self):
         return self._SERIAL_DATASTRUCT_BUFFERSIZE;
@@ -133,14 +266,15 @@ class AWESEM_PiPion_Interface:
                 if self._currentlyConnected:
                     if self._dacFrequencies is None:
                         self._dacFrequencies = dict()
-                    for index in range(0, 2): # 0, 1
-                        self._sendBytes(struct.pack('<cb', b'f', dacChannel))
-                        response = self._readBytes(1)
-                        if response == b'A':
-                            self._dacFrequencies[index] = struct.unpack('<f', self._readBytes(4))
+                    # Queries both channels before reading either response
+                    requests = [self._request(struct.pack('<cb', b'f', index), lambda: self._readAckAndBytes(4)) for index in range(0, 2)]
+                    for index, request in enumerate(requests): # 0, 1
+                        payload = self._readResponses(request)
+                        if payload:
+                            self._dacFrequencies[index] = struct.unpack('<f', payload)[0]
                         else:
                             if self._verbose:
-                                print("Error: McuInterface_getDacFrequency, ackowledgement failure '%s'" % response.hex())
+                                print("Error: McuInterface_getDacFrequency, ackowledgement failure")
                             return None
                 else:
                     if self._verbose:
@@ -166,8 +300,7 @@ class AWESEM_PiPion_Interface:
         """
         with self._guardLock:
             if self._currentlyConnected:
-                self._sendBytes(struct.pack('<cbf', b'F', dacChannel, dacFrequency))
-                response = self._readBytes(1)
+                response = self._exchange(struct.pack('<cbf', b'F', dacChannel, dacFrequency), self._readAck)
                 if response == b'A':
                     if self._dacFrequencies is None: # No history exists
                         self.getDacFrequency(0) # Forces loading of history from MCU
@@ -199,14 +332,15 @@ class AWESEM_PiPion_Interface:
                 if self._currentlyConnected:
                     if self._dacMagnitudes is None:
                         self._dacMagnitudes = dict()
-                    for index in range(0, 2):
-                        self._sendBytes(struct.pack('<cb', b'm', dacChannel))
-                        response = self._readBytes(1)
-                        if response == b'A':
-                            self._dacMagnitudes[index] = struct.unpack('<f', self._readBytes(4))
+                    # Queries both channels before reading either response
+                    requests = [self._request(struct.pack('<cb', b'm', index), lambda: self._readAckAndBytes(4)) for index in range(0, 2)]
+                    for index, request in enumerate(requests):
+                        payload = self._readResponses(request)
+                        if payload:
+                            self._dacMagnitudes[index] = struct.unpack('<f', payload)[0]
                         else:
                             if self._verbose:
-                                print("Error: McuInterface_getDacMagnitude, acknowledgement failure '%s'" % response.hex())
+                                print("Error: McuInterface_getDacMagnitude, acknowledgement failure")
                             return None
                 else:
                     if self._verbose:
@@ -231,8 +365,7 @@ class AWESEM_PiPion_Interface:
         """
         with self._guardLock:
             if self._currentlyConnected:
-                self._sendBytes(struct.pack('<cbf', b'M', dacChannel, dacMagnitude))
-                response = self._readBytes(1)
+                response = self._exchange(struct.pack('<cbf', b'M', dacChannel, dacMagnitude), self._readAck)
                 if response == b'A':
                     if self._dacMagnitudes is None: # No history exists
                         self.getDacMagnitude(0) # Forces loading of history from MCU
@@ -265,14 +398,15 @@ class AWESEM_PiPion_Interface:
                 if self._currentlyConnected:
                     if self._dacWaveforms is None: # No prior history
                         self._dacWaveforms = dict() # Creates history structure
-                    for index in range(0, 2): # 0, 1
-                        self._sendBytes(struct.pack('<cb', b'w', dacChannel))
-                        response = self._readBytes(1)
-                        if response == b'A':
-                            self._dacWaveforms[index] = struct.unpack('<b', self._readBytes(1))
+                    # Queries both channels before reading either response
+                    requests = [self._request(struct.pack('<cb', b'w', index), lambda: self._readAckAndBytes(1)) for index in range(0, 2)]
+                    for index, request in enumerate(requests): # 0, 1
+                        payload = self._readResponses(request)
+                        if payload:
+                            self._dacWaveforms[index] = struct.unpack('<b', payload)[0]
                         else:
                             if self._verbose:
-                                print("Error: McuInterface_getDacWaveform, ackowledgement failure '%s'" % response.hex())
+                                print("Error: McuInterface_getDacWaveform, ackowledgement failure")
                             return None
                 else:
                     if self._verbose:
@@ -296,8 +430,7 @@ class AWESEM_PiPion_Interface:
         """
         with self._guardLock:
             if self._currentlyConnected:
-                self._sendBytes(struct.pack('<cbb', b'W', dacChannel, dacWaveform))
-                response = self._readBytes(1)
+                response = self._exchange(struct.pack('<cbb', b'W', dacChannel, dacWaveform), self._readAck)
                 if response == b'A':
                     if self._dacWaveforms is None: # No client-side history
                         self.getDacWaveform(0) # Creates client-side history structure
@@ -325,13 +458,12 @@ class AWESEM_PiPion_Interface:
         if self._adcFrequency is None or forceDirect:
             with self._guardLock:
                 if self._currentlyConnected:
-                    self._sendBytes(struct.pack('<c', b's'))
-                    response = self._readBytes(1)
-                    if response == b'A':
-                        self._adcFrequency = struct.unpack('<f', self._readBytes(4))
+                    payload = self._exchange(struct.pack('<c', b's'), lambda: self._readAckAndBytes(4))
+                    if payload:
+                        self._adcFrequency = struct.unpack('<f', payload)[0]
                     else:
                         if self._verbose:
-                            print("Error: McuInterface_getAdcFrequency, acknowledgement failure '%s'" % response.hex())
+                            print("Error: McuInterface_getAdcFrequency, acknowledgement failure")
                         return None
                 else:
                     if self._verbose:
@@ -353,8 +485,7 @@ class AWESEM_PiPion_Interface:
         """
         with self._guardLock:
             if self._currentlyConnected:
-                self._sendBytes(struct.pack('<cf', b'S', adcFrequency))
-                response = self._readBytes(1)
+                response = self._exchange(struct.pack('<cf', b'S', adcFrequency), self._readAck)
                 if response == b'A':
                     self._adcFrequency = adcFrequency
                     return True
@@ -385,13 +516,12 @@ class AWESEM_PiPion_Interface:
         if self._adcAverages is None or forceDirect:
             with self._guardLock:
                 if self._currentlyConnected:
-                    self._sendBytes(struct.pack('<c', b'u'))
-                    response = self._readBytes(1)
-                    if response == b'A':
-                        self._adcAverages = struct.unpack('<b', self._readBytes(1))
+                    payload = self._exchange(struct.pack('<c', b'u'), lambda: self._readAckAndBytes(1))
+                    if payload:
+                        self._adcAverages = struct.unpack('<b', payload)[0]
                     else:
                         if self._verbose:
-                            print("Error: McuInterface_getAdcAverages, ackowledgement failure '%s'" % response.hex())
+                            print("Error: McuInterface_getAdcAverages, ackowledgement failure")
                 else:
                     if self._verbose:
                         print("Error: McuInterface_getAdcAverages, unit disconnected")
@@ -415,8 +545,7 @@ class AWESEM_PiPion_Interface:
         """
         with self._guardLock:
             if self._currentlyConnected:
-                self._sendBytes(struct.pack('<cb', b'U', adcAverages))
-                response = self._readBytes(1)
+                response = self._exchange(struct.pack('<cb', b'U', adcAverages), self._readAck)
                 if response == b'A':
                     self._adcAverages = adcAverages
                     return True
@@ -431,39 +560,108 @@ class AWESEM_PiPion_Interface:
                     print("Error: McuInterface_setAdcAverages, unit disconnected")
         return False
 
+    def setParameters(self, dacFrequencies = None, dacMagnitudes = None, dacWaveforms = None, adcFrequency = None, adcAverages = None):
+        """
+        Description:
+          Sets several DAC and ADC parameters in one transaction. All commands are
+          sent before any acknowledgement is read, and if scanning, events are
+          restarted once at the end of the same transaction.
+
+        Parameters:
+          'dacFrequencies' Dictionary of DAC channel (0 or 1) to frequency, None to leave unchanged.
+          'dacMagnitudes'  Dictionary of DAC channel (0 or 1) to magnitude in volts.
+          'dacWaveforms'   Dictionary of DAC channel (0 or 1) to waveform.
+          'adcFrequency'   Sampling frequency in Hz.
+          'adcAverages'    Number of averaged samples per ADC result.
+
+        Returns:
+          True if every parameter was acknowledged, false otherwise. Only
+          acknowledged parameters are updated in the client-side history.
+        """
+        with self._guardLock:
+            if not self._currentlyConnected:
+                if self._verbose:
+                    print("Error: McuInterface_setParameters, unit disconnected")
+                return False
+
+            # Loads the history of both channels so a partial update can't leave it incomplete
+            if dacFrequencies and self._dacFrequencies is None:
+                self.getDacFrequency(0)
+            if dacMagnitudes and self._dacMagnitudes is None:
+                self.getDacMagnitude(0)
+            if dacWaveforms and self._dacWaveforms is None:
+                self.getDacWaveform(0)
+
+            # Commands with the history to update once acknowledged
+            commands = []
+            for dacChannel, dacFrequency in (dacFrequencies or {}).items():
+                commands.append((struct.pack('<cbf', b'F', dacChannel, dacFrequency), self._dacFrequencies, dacChannel, dacFrequency))
+            for dacChannel, dacMagnitude in (dacMagnitudes or {}).items():
+                commands.append((struct.pack('<cbf', b'M', dacChannel, dacMagnitude), self._dacMagnitudes, dacChannel, dacMagnitude))
+            for dacChannel, dacWaveform in (dacWaveforms or {}).items():
+                commands.append((struct.pack('<cbb', b'W', dacChannel, dacWaveform), self._dacWaveforms, dacChannel, dacWaveform))
+            if adcFrequency is not None:
+                commands.append((struct.pack('<cf', b'S', adcFrequency), None, '_adcFrequency', adcFrequency))
+            if adcAverages is not None:
+                commands.append((struct.pack('<cb', b'U', adcAverages), None, '_adcAverages', adcAverages))
+
+            requests = [self._request(command[0], self._readAck) for command in commands]
+            # Settings take effect once events are restarted
+            restartEvents = self._currentlyScanning and len(commands) > 0
+            if restartEvents:
+                self._currentlyScanning = False
+                requests.append(self._request(struct.pack('<c', b'H'), self._readAck))
+                requests.append(self._request(struct.pack('<c', b'B'), self._readAck))
+
+            success = True
+            for index, request in enumerate(requests):
+                response = self._readResponses(request)
+                if index < len(commands):
+                    command, history, key, value = commands[index]
+                    if response == b'A':
+                        if history is None:
+                            setattr(self, key, value)
+                        else:
+                            history[key] = value
+                        continue
+                    if self._verbose:
+                        if response == b'F':
+                            print("Error: McuInterface_setParameters, bad arguments for '%s'" % command.hex())
+                        else:
+                            print("Error: McuInterface_setParameters, ackowledgement failure '%s'" % response.hex())
+                elif response == b'A':
+                    if index == len(requests) - 1: # Events restarted
+                        # Buffers read ahead were sampled with the previous settings
+                        self._receivedBuffers.clear()
+                        self._currentlyScanning = True
+                    continue
+                elif self._verbose:
+                    print("Error: McuInterface_setParameters, failed to restart events '%s'" % response.hex())
+                success = False
+            return success
+
     def getDataBuffer(self):
         """
         Description:
             Acquires a data buffer from the MCU.
         Returns:
-            Returns an array of the form [dac 0 offset in uS, dac 1 offset in uS, byteValues]
+            Returns an AWESEM_PiPion_DataBuffer with the samples and their timing,
+            None if no buffer was received.
+
+        Note:
+            Keeps up to the pipeline depth of requests in flight (see setPipelineDepth).
         """
         with self._guardLock:
             if self._currentlyConnected:
-                self._sendBytes(struct.pack('<c', b'A'))
-                response = self._readBytes(1)
-                if response == b'A':
-                    currentNumber = struct.unpack('<I', self._readBytes(4))
-                    if(currentNumber[0] - self._lastPacketID - 1 > 0):
-                        print("Error, McuInterface_getDataBuffer, missed %d packets" % (currentNumber[0] - self._lastPacketID - 1))
-                    self._lastPacketID = currentNumber[0]
-                    # Result consists of three 32 bit integers and then an
-                    # array of bytes.
-                    aOffset  = (struct.unpack('<I', self._readBytes(4)))[0] # In milliseconds
-                    bOffset  = (struct.unpack('<I', self._readBytes(4)))[0] # In milliseconds
-                    duration = (struct.unpack('<I', self._readBytes(4)))[0]
-                    byteList = self._readBytes(self._SERIAL_DATASTRUCT_BUFFERSIZE)
-                    byteArray = numpy.frombuffer(byteList, numpy.uint8)
-                    value = numpy.stack((numpy.linspace(bOffset, bOffset + duration, self._SERIAL_DATASTRUCT_BUFFERSIZE) / 1000000.0, numpy.linspace(aOffset, aOffset + duration, self._SERIAL_DATASTRUCT_BUFFERSIZE) / 1000000.0, byteArray), 1) # format is [data, aTimes, bTimes] as column vectors
-                    return value
-                #elif response == b'F':
-                    #if self._verbose:
-                        #print("Error: AWSEM_getDataBuffer, no buffer ready")
-                    #return None
-                else:
-                    if self._verbose:
-                        print("Error: McuInterface_getDataBuffer, ackowledgement failure '%s'" % response.hex())
-                    return None
+                while self._buffersInFlight < self._pipelineDepth:
+                    self._request(struct.pack('<c', b'A'), self._readDataBuffer, isBuffer = True)
+                if self._receivedBuffers:
+                    return self._receivedBuffers.popleft()
+                # Oldest buffer request, responses arrive in order
+                for request in self._expectedResponses:
+                    if request[1]:
+                        return self._readResponses(request) or None
+                return None
             else:
                 if self._verbose:
                     print("Error: McuInterface_getDataBuffer, unit disconnected")
@@ -476,9 +674,10 @@ class AWESEM_PiPion_Interface:
         with self._guardLock:
             if self._currentlyConnected:
                 outMessage = struct.pack('<c', b'B')
-                self._sendBytes(outMessage)
-                response = self._readBytes(1)
+                response = self._exchange(outMessage, self._readAck)
                 if response == b'A':
+                    # Buffers read ahead were sampled with the previous settings
+                    self._receivedBuffers.clear()
                     self._currentlyScanning = True
                     return True
                 else:
@@ -495,9 +694,8 @@ class AWESEM_PiPion_Interface:
         with self._guardLock:
             if self._currentlyConnected:
                 outMessage = struct.pack('<c', b'H')
-                self._sendBytes(outMessage)
                 self._currentlyScanning = False
-                response = self._readBytes(1)
+                response = self._exchange(outMessage, self._readAck)
                 if response == b'A':
                     return True
                 else:
@@ -515,36 +713,269 @@ class AWESEM_PiPion_Interface:
     def _sendBytes(self, command):
         """Sends a serial command to the PiPion in the form of a byte array
         """
-        self._serialPort.write(command)
+        try:
+            self._serialPort.write(command)
+        except (serial.SerialException, OSError):
+            self._linkDropped()
 
     def _readBytes(self, numBytes):
         """Reads values from the PiPion
         """
-        value = self._serialPort.read(numBytes)
+        try:
+            value = self._serialPort.read(numBytes)
+        except (serial.SerialException, OSError):
+            self._linkDropped()
+            return b''
         return value
 
+    def _readAck(self):
+        """Reads the acknowledgement of a command, 'A' if succesful
+        """
+        return self._readBytes(1)
+
+    def _readAckAndBytes(self, numBytes):
+        """Reads the acknowledgement and the value of a query, returns the value bytes or
+        None on failure
+        """
+        if self._readBytes(1) != b'A':
+            return None
+        value = self._readBytes(numBytes)
+        if len(value) != numBytes:
+            return None
+        return value
+
+    def _request(self, command, readResponse, isBuffer = False):
+        """
+        Description:
+          Sends a command without waiting for the response. Responses are read in the
+          order the commands were sent (see _readResponses).
+
+        Parameters:
+          'command'      Bytes to send.
+          'readResponse' Reads and returns the response of the command.
+          'isBuffer'     True for buffer requests.
+
+        Returns:
+          The request, to be passed to _readResponses.
+        """
+        self._sendBytes(command)
+        request = (readResponse, isBuffer)
+        self._expectedResponses.append(request)
+        if isBuffer:
+            self._buffersInFlight = self._buffersInFlight + 1
+        return request
+
+    def _readResponses(self, request):
+        """
+        Description:
+          Reads responses in order until the response of the given request. Buffers
+          received in the meantime are kept for getDataBuffer.
+
+        Returns:
+          The response of the request, b'' if it was lost. Buffer requests answer
+          False if no buffer was ready.
+        """
+        while self._expectedResponses:
+            current = self._expectedResponses.popleft()
+            readResponse, isBuffer = current
+            value = readResponse()
+            if isBuffer:
+                self._buffersInFlight = self._buffersInFlight - 1
+                if value is None:
+                    # Position in the stream is unknown, so drops the outstanding requests
+                    self._resynchronize()
+                    return None if current is request else b''
+            if current is request:
+                return value
+            if isBuffer and value:
+                self._receivedBuffers.append(value)
+        return b''
+
+    def _exchange(self, command, readResponse):
+        """Sends a command and returns its response (see _request and _readResponses)
+        """
+        return self._readResponses(self._request(command, readResponse))
+
+    def _resynchronize(self):
+        """Forgets the requests in flight and discards any data received for them.
+        Responses still on their way (ie. late acknowledgements of commands already
+        sent) are read until the line goes quiet, so none is mistaken for the start
+        of the next response.
+        """
+        if self._verbose and self._expectedResponses:
+            print("Error: McuInterface, dropped %d requests in flight" % len(self._expectedResponses))
+        if self._currentlyConnected:
+            self._serialPort.reset_input_buffer()
+            # The MCU only sends in response to requests, so this ends
+            while self._currentlyConnected and self._readBytes(self._SERIAL_DATASTRUCT_BUFFERSIZE):
+                pass
+        self._expectedResponses.clear()
+        self._buffersInFlight = 0
+
+    def _readIntoBytes(self, buffer):
+        """Reads values from the PiPion into the given buffer, returns the number of bytes read
+        """
+        try:
+            return self._serialPort.readinto(buffer)
+        except (serial.SerialException, OSError):
+            self._linkDropped()
+            return 0
+
+    def _linkDropped(self):
+        """
+        Description:
+          Marks the PiPion as disconnected after a serial error (ie. the USB cable was
+          unplugged) and starts reconnecting in the background. Commands fail with
+          'unit disconnected' until the link is back.
+        """
+        if not self._currentlyConnected:
+            return
+        if self._verbose:
+            print("Error: McuInterface, lost connection with the PiPion")
+        self._setConnected(False)
+        self._currentlyScanning = False
+        self._expectedResponses.clear()
+        self._buffersInFlight = 0
+        try:
+            self._serialPort.close()
+        except (serial.SerialException, OSError):
+            pass
+        if self._autoReconnect and not self._closing.is_set() and (self._reconnectThread is None or not self._reconnectThread.is_alive()):
+            self._reconnectThread = Thread(target = self._reconnectInBackground, name = "PiPionReconnect")
+            self._reconnectThread.daemon = True
+            self._reconnectThread.start()
+
+    def _setConnected(self, connected):
+        """Updates the connection state and wakes threads in waitForConnection
+        """
+        with self._connectionChanged:
+            self._currentlyConnected = connected
+            self._connectionChanged.notify_all()
+
+    def _reconnectInBackground(self):
+        """Retries finding the PiPion until it answers or the interface is closed
+        """
+        while self._autoReconnect and not self._closing.wait(self._SERIAL_RECONNECTIONINTERVAL):
+            if self.reconnectToPion():
+                if self._verbose:
+                    print("McuInterface, Reconnected to the PiPion.")
+                # The MCU may have been reset, so starts from a known state
+                self.pauseEvents()
+                return
+
+    def _readDataBuffer(self):
+        """
+        Description:
+          Reads the response to a buffer request ('A'). The acknowledgement is read
+          on its own, since the MCU answers with a single 'F' if no buffer is ready.
+          The header and samples are then read at once, and the samples are kept in
+          the packet memory rather than copied.
+
+        Returns:
+          AWESEM_PiPion_DataBuffer, False if no buffer was ready, None if the response
+          is not a complete buffer (ie. the position in the stream is lost).
+        """
+        header = self._SERIAL_DATASTRUCT_HEADER
+        packet = bytearray(header.size + self._SERIAL_DATASTRUCT_BUFFERSIZE)
+        response = self._readBytes(1)
+        if response == b'F':
+            return False
+        if response != b'A':
+            if self._verbose:
+                print("Error: McuInterface_getDataBuffer, ackowledgement failure '%s'" % response.hex())
+            return None
+        packet[0:1] = response
+        numRead = 1 + self._readIntoBytes(memoryview(packet)[1:])
+        if numRead < len(packet):
+            if self._verbose:
+                print("Error: McuInterface_getDataBuffer, incomplete buffer of %d bytes" % numRead)
+            return None
+
+        response, packetID, aOffset, bOffset, duration = header.unpack_from(packet)
+        if(packetID - self._lastPacketID - 1 > 0):
+            self._missedPackets = self._missedPackets + (packetID - self._lastPacketID - 1)
+            print("Error, McuInterface_getDataBuffer, missed %d packets" % (packetID - self._lastPacketID - 1))
+        self._lastPacketID = packetID
+
+        samples = numpy.frombuffer(packet, numpy.uint8, offset = header.size)
+        return AWESEM_PiPion_DataBuffer(packetID, aOffset, bOffset, duration, samples)
+
     def _findPort(self):
-        portList = list_ports.comports()
+        """
+        Description:
+          Searches the serial ports for the PiPion. The last port it answered on is
+          tried first, then ports with the Teensy's USB ids and then every other
+          port. Ports in each group are probed concurrently, so a port that hangs
+          only delays its own probe.
+
+        Returns:
+          An open serial port to the PiPion, None if it wasn't found.
+        """
         if self._verbose:
             print("McuInterface, Searching for the PiPion:")
         for index in range(0, self._SERIAL_RECONNECTIONATTEMPTS):
-            for currentPort in portList:
-                try:
-                    self._serialPort = serial.Serial(currentPort.device)
-                    self._serialPort.close()
-                    self._serialPort.open()
+            portList = list_ports.comports()
+            usbPorts = [currentPort.device for currentPort in portList if (currentPort.vid, currentPort.pid) in self._SERIAL_USBIDS]
+            otherPorts = [currentPort.device for currentPort in portList if currentPort.device not in usbPorts]
+            if self._verbose:
+                for currentPort in portList:
+                    print("  -> Port: %s, %s, %s" % (currentPort.device, currentPort.name, currentPort.description))
+            candidateGroups = [usbPorts, otherPorts]
+            if self._lastKnownPort is not None:
+                candidateGroups.insert(0, [self._lastKnownPort])
+            triedPorts = set()
+            for candidates in candidateGroups:
+                candidates = [device for device in candidates if device not in triedPorts]
+                triedPorts.update(candidates)
+                serialPort = self._probePorts(candidates)
+                if serialPort is not None:
+                    AWESEM_PiPion_Interface._lastKnownPort = serialPort.port
                     if self._verbose:
-                        print("  -> Port: %s, %s, %s" % (currentPort.device, currentPort.name, currentPort.description))
-                except:
-                    continue
-                self._serialPort.timeout = self._SERIAL_TIMEOUT
-                if self.ping():
-                    self._currentlyConnected = True
-                    if self._verbose:
-                        print('McuInterface, Connection established with the PiPion.')
-                    return True
-                else:
-                    self._serialPort.close()
+                        print('McuInterface, Connection established with the PiPion on %s.' % serialPort.port)
+                    return serialPort
         if self._verbose:
             print('McuInterface, No serial ports found for the PiPion.')
-        return False
+        return None
+
+    def _probePorts(self, devices):
+        """Probes the given ports concurrently, returns the open serial port of the
+        first one that answers, None if none do
+        """
+        if not devices:
+            return None
+        executor = ThreadPoolExecutor(max_workers = len(devices))
+        pending = set(executor.submit(self._probePort, device) for device in devices)
+        found = None
+        while pending and found is None:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                serialPort = future.result()
+                if serialPort is None:
+                    continue
+                if found is None:
+                    found = serialPort
+                else:
+                    serialPort.close()
+        # Ports still probing are closed as they finish, without waiting on them
+        for future in pending:
+            future.add_done_callback(lambda future: future.result() and future.result().close())
+        executor.shutdown(wait = False)
+        return found
+
+    def _probePort(self, device):
+        """Opens the port and pings it on its own, outside of the request queue.
+        Returns the open serial port if the PiPion answered, None otherwise.
+        """
+        try:
+            serialPort = serial.Serial(device, timeout = self._SERIAL_TIMEOUT, write_timeout = self._SERIAL_TIMEOUT)
+        except (serial.SerialException, OSError, ValueError):
+            return None
+        try:
+            serialPort.reset_input_buffer()
+            serialPort.write(b'p')
+            if serialPort.read(1) == b'A':
+                return serialPort
+        except (serial.SerialException, OSError):
+            pass
+        serialPort.close()
+        return None
@@ -21,6 +21,7 @@ TODO:
  - might be better
 """
 
+import queue
 import threading
 import numpy
 import numpy_indexed
@@ -39,30 +40,64 @@ class Register(threading.Thread):
     __StandardCallback            = None
     __xOffset                     = 0.0
     __yOffset                     = 0.0
-    __MCUInterface                = None
-    __DoSample                    = False
+    __DoSample                    = None
+    __Stopping                    = None
 
-    def __init__(self, outputCallback, MCUInterface):
+    def __init__(self, outputCallback, inputQueue):
+        """
+        Parameters:
+          'outputCallback' Called with the registered points of each sample block.
+          'inputQueue'     Bounded queue.Queue of sample blocks filled by Data.DataIn,
+                           this thread is its only consumer.
+        """
         threading.Thread.__init__(self)
+        self.daemon = True # Blocked on the queue otherwise keeps the GUI from exiting
         self.__OutputCallback = outputCallback
-        self.__MCUInterface   = MCUInterface
+        self.__InputBuffer    = inputQueue
+        self.__DoSample       = threading.Event()
+        self.__Stopping       = threading.Event()
 
     def run(self):
-        while True:
-            if self.__DoSample:
-                value = self.__MCUInterface.getDataBuffer()
-                if value is not None:
-                    self.__OutputCallback(self.registerPoints(value))
+        while not self.__Stopping.is_set():
+            self.__DoSample.wait()
+            value = self.__InputBuffer.get() # Blocks until DataIn provides a buffer
+            if value is None or not self.__DoSample.is_set(): # None is sent by stop()
+                continue
+            self.__OutputCallback(self.registerPoints(value))
 
     def halt(self):
-        """Stops acquiring sample blocks for continous streaming.
+        """Stops registering sample blocks for continous streaming.
         """
-        self.__DoSample = False
+        self.__DoSample.clear()
 
     def commence(self):
-        """Starts acquiring sample blocks for continuous streaming.
+        """Starts registering sample blocks for continuous streaming. Blocks
+        left over from before the last halt are discarded.
+        """
+        try:
+            while True:
+                self.__InputBuffer.get_nowait()
+        except queue.Empty:
+            pass
+        self.__DoSample.set()
+
+    def stop(self):
+        """Ends the thread, returns once the current block is registered or
+        after Const.THREAD_STOP_TIMEOUT (ie. if the output callback is stuck).
         """
-        self.__DoSample = True
+        self.__Stopping.set()
+        self.__DoSample.set() # Wakes the thread if halted
+        # Drops the blocks left so the wake up fits, DataIn is stopped first
+        try:
+            while True:
+                self.__InputBuffer.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            self.__InputBuffer.put_nowait(None) # Wakes the thread if waiting on the queue
+        except queue.Full:
+            pass
+        self.join(timeout = Const.THREAD_STOP_TIMEOUT)
 
     def registerPoints(self, newestBuffer, functionX = None, functionY = None, filterX = None, filterY = None):
         """
@@ -70,7 +105,7 @@ class Register(threading.Thread):
           Assigns screen coordinate locations to the given sample data block.
 
         Parameters:
-          'newestBuffer'  Buffer of the format: (aTimestamp, bTimestamp, value (byte); ... ; ...)
+          'newestBuffer'  AWESEM_PiPion_DataBuffer, x uses the b timestamps and y the a timestamps
           'functionX'     Callback to translate timestamps in microseconds to position, if specified overrides internal function
           'functionY'     Callback to translate timestamps in microseconds to position, if specified overrides internal function
           'filterX'       Callback to filter timestamps, if specified overrides internal function
@@ -87,22 +122,26 @@ class Register(threading.Thread):
             filterY = self.__DataFilterY
 
         # Applies offsets
-        newestBuffer[:, 0] = newestBuffer[:, 0] + self.__xOffset;
-        newestBuffer[:, 1] = newestBuffer[:, 1] + self.__yOffset;
+        xTimes = newestBuffer.bTimes + self.__xOffset
+        yTimes = newestBuffer.aTimes + self.__yOffset
+        values = newestBuffer.samples
 
         # Applies filter function
-        boolX = numpy.ones(len(newestBuffer), dtype = bool)
-        if filterX is not None:
-            boolX = filterX(newestBuffer[:, 0])
-        boolY = numpy.ones(len(newestBuffer), dtype = bool)
-        if filterY is not None:
-            boolY = filterY(newestBuffer[:, 1])
-        boolTotal = numpy.logical_and(boolX, boolY)
-        newestBuffer = newestBuffer[boolTotal, :]
-
-        if(newestBuffer.size > 0):
+        if filterX is not None or filterY is not None:
+            boolX = numpy.ones(len(values), dtype = bool)
+            if filterX is not None:
+                boolX = filterX(xTimes)
+            boolY = numpy.ones(len(values), dtype = bool)
+            if filterY is not None:
+                boolY = filterY(yTimes)
+            boolTotal = numpy.logical_and(boolX, boolY)
+            xTimes = xTimes[boolTotal]
+            yTimes = yTimes[boolTotal]
+            values = values[boolTotal]
+
+        if(values.size > 0):
             # Applies translation function
-            assignedPositionVals = numpy.stack((functionX(newestBuffer[:, 0]), functionY(newestBuffer[:, 1]), newestBuffer[:, 2]), 1).astype(int)
+            assignedPositionVals = numpy.stack((functionX(xTimes), functionY(yTimes), values), 1).astype(int)
             # Merges duplicate coordinates
             numpy_indexed.group_by(assignedPositionVals[:, [0, 1]]).mean(assignedPositionVals)
             return assignedPositionVals
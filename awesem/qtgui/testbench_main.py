@@ -48,6 +48,7 @@ Description
 from   time                          import perf_counter
 from   collections                   import deque
 import sys
+import queue
 import numpy
 import datetime
 from   matplotlib                    import cm
@@ -58,6 +59,7 @@ from   awesem.qtgui.testbench_autocode     import Ui_MainWindow
 from   awesem.qtgui.pipion_interface       import AWESEM_PiPion_Interface
 import awesem.qtgui.constants              as Const
 import awesem.qtgui.register               as Register
+import awesem.qtgui.data                   as Data
 import awesem.qtgui.analysis               as Analysis
 
 if hasattr(Qt, 'AA_EnableHighDpiScaling'):
@@ -99,6 +101,7 @@ class Stream(QObject):
 class TestBench(QMainWindow):
 
     __MCUInterface      = None
+    __dataTh            = None
     __registerTh        = None
     __consoleOut        = None
     __ScanImage         = QImage('grid.png')
@@ -107,16 +110,31 @@ class TestBench(QMainWindow):
 
     def __init__(self, *args, **kwargs):
         super(TestBench, self).__init__(*args, **kwargs)
-        # Structure is MCU -(interface)-> dataTh -(double buffer)-> registerTh -(callback)-> monitor
-        self.__MCUInterface = AWESEM_PiPion_Interface()
-        self.__registerTh   = Register.Register(self.updateQTImage, self.__MCUInterface)
+        # Structure is MCU -(interface)-> dataTh -(bounded queue)-> registerTh -(callback)-> monitor
+        self.__MCUInterface = AWESEM_PiPion_Interface(Const.MCU_PIPELINE_DEPTH)
+        dataQueue           = queue.Queue(maxsize = Const.BUFFLEN_DATA_TO_REGISTER)
+        self.__dataTh       = Data.DataIn(self.__MCUInterface, dataQueue)
+        self.__registerTh   = Register.Register(self.updateQTImage, dataQueue)
         self.setupTheUi()
         self.setDefaults()
+        self.__dataTh.start()
         self.__registerTh.start()
 
     def __del__(self):
         sys.stdout = sys.__stdout__ # Sets print mode back to normal
 
+    #
+    # Description:
+    #   Stops the data and register threads before the window closes, so
+    #   they aren't killed in the middle of a request to the MCU.
+    #
+    def closeEvent(self, event):
+        self.__dataTh.stop() # Stops producing first so the register thread can drain
+        self.__registerTh.stop()
+        if(self.__MCUInterface.isScanning()):
+            self.__MCUInterface.pauseEvents()
+        super(TestBench, self).closeEvent(event)
+
     #
     # Description:
     # TODO LUT, ScanMode, saveImage, imageCorrection
@@ -219,12 +237,14 @@ class TestBench(QMainWindow):
     def toggleScanning(self):
         if(self.__MCUInterface.isScanning()):
             self.__UiElems.Scan_Pushbutton.setText("Start Scanning")
+            self.__dataTh.halt()
             self.__MCUInterface.pauseEvents()
             self.__registerTh.halt()
         else:
             self.__UiElems.Scan_Pushbutton.setText("Stop Scanning")
-            self.__MCUInterface.beginEvents()
             self.__registerTh.commence()
+            self.__MCUInterface.beginEvents()
+            self.__dataTh.commence()
 
     #
     # Description:
@@ -277,24 +297,25 @@ class TestBench(QMainWindow):
                 "Sawtooth" : 1, # Square is 2). currently unused
                 "Triangle" : 3
                 }
+        dacMagnitudes  = {}
+        dacFrequencies = {}
+        dacWaveforms   = {}
         # Handles vertical
-        self.__MCUInterface.setDacMagnitude(0, self.__UiElems.Vertical_Amplitude_Spinbox.value())
-        self.__MCUInterface.setDacFrequency(0, self.__UiElems.Vertical_Frequency_Spinbox.value())
+        dacMagnitudes[0]  = self.__UiElems.Vertical_Amplitude_Spinbox.value()
+        dacFrequencies[0] = self.__UiElems.Vertical_Frequency_Spinbox.value()
         result = waveformLabels.get(self.__UiElems.Vertical_Waveform_Combobox.currentText())
         if(result is not None):
-            self.__MCUInterface.setDacWaveform(0, result)
+            dacWaveforms[0] = result
 
         # Handles horizontal
-        self.__MCUInterface.setDacMagnitude(1, self.__UiElems.Horizontal_Amplitude_Spinbox.value())
-        self.__MCUInterface.setDacFrequency(1, self.__UiElems.Horizontal_Frequency_Spinbox.value())
+        dacMagnitudes[1]  = self.__UiElems.Horizontal_Amplitude_Spinbox.value()
+        dacFrequencies[1] = self.__UiElems.Horizontal_Frequency_Spinbox.value()
         result = waveformLabels.get(self.__UiElems.Horizontal_Waveform_Combobox.currentText())
         if(result is not None):
-            self.__MCUInterface.setDacWaveform(1, result)
+            dacWaveforms[1] = result
 
-        # Refreshes MCU
-        if(self.__MCUInterface.isScanning()): # If not scanning will take effect on startup anyway
-            self.__MCUInterface.pauseEvents()
-            self.__MCUInterface.beginEvents()
+        # Sends everything in one transaction, which also refreshes the MCU if scanning
+        self.__MCUInterface.setParameters(dacFrequencies = dacFrequencies, dacMagnitudes = dacMagnitudes, dacWaveforms = dacWaveforms)
 
         # Updates LUT methods to reflect new waveform
         self.setSamplingReconstruction()
@@ -389,10 +410,7 @@ class TestBench(QMainWindow):
     #
     def setSamplingFrequency(self): # TODO
         newFrequency = self.__UiElems.Sampling_Frequency_Spinbox.value() * 1000.0 # Spinbox shows kHz, need to provide hz
-        self.__MCUInterface.setAdcFrequency(newFrequency)
-        if(self.__MCUInterface.isScanning()):
-            self.__MCUInterface.pauseEvents()
-            self.__MCUInterface.beginEvents()
+        self.__MCUInterface.setParameters(adcFrequency = newFrequency) # Also refreshes the MCU if scanning
 
 if __name__ == "__main__":
     if not QApplication.instance():
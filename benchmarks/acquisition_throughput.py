@@ -0,0 +1,179 @@
+"""
+Acquisition Throughput Benchmark
+================================
+
+Measures how fast scans are ingested, without any hardware. A simulated Teensy (see
+simulated_teensy.py) streams samples through pseudo-terminals which replace the Teensy's
+serial ports.
+
+Two targets can be benchmarked:
+
+- scan_control: ImageScanControl.read_data on its own (ie. the serial reads)
+- video_feed: the web app's video feed end-to-end, from the serial reads in
+  VideoFeed._thread_read_data to the frames streamed to a client
+
+For each scan, the bytes/s, rows/s, dropped rows (ie. missing or short rows) and CPU
+time are reported. Samples dropped by the simulated UART (ie. the reader fell behind)
+are reported at the end.
+
+Usage (from the root of the repository):
+
+    python -m benchmarks.acquisition_throughput --target video_feed --scans 3
+    python -m benchmarks.acquisition_throughput --target scan_control --line-rate
+    python -m benchmarks.acquisition_throughput --recording scan.bin --baudrate 1e6
+"""
+import sys
+import time
+import argparse
+import threading
+
+from loguru import logger
+
+from awesem.image_scan_control import ImageScanControl
+from benchmarks.simulated_teensy import SimulatedTeensy
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Acquisition throughput benchmark with a simulated Teensy")
+    parser.add_argument("--target", choices=("scan_control", "video_feed"), default="video_feed")
+    parser.add_argument("--scans", type=int, default=3, help="Number of scans")
+    parser.add_argument("--baudrate", type=float, default=ImageScanControl.DATA_BAUDRATE, help="Baud rate of the data port")
+    parser.add_argument("--slow-axis", type=float, default=1.0, help="Slow axis frequency (Hz)")
+    parser.add_argument("--fast-axis", type=float, default=20.0, help="Fast axis frequency (Hz)")
+    parser.add_argument("--sampling-frequency", type=float, default=20e3, help="Sampling frequency (Hz)")
+    parser.add_argument("--line-rate", action="store_true", help="Stream as fast as the baud rate allows")
+    parser.add_argument("--recording", help="File with raw samples to replay instead of a synthetic image")
+    parser.add_argument("--zero-copy", action="store_true", help="Read into a ring buffer (scan_control only)")
+    parser.add_argument("--log-level", default="WARNING")
+
+    return parser.parse_args()
+
+def print_scan(index:int, num_bytes:int, rows:int, rows_per_scan:int, short_rows:int, elapsed_sec:float, cpu_sec:float):
+    dropped_rows = max(rows_per_scan - rows, 0) + short_rows
+
+    print(
+        f"Scan {index}: {num_bytes / elapsed_sec:10.0f} bytes/s  {rows / elapsed_sec:8.1f} rows/s  "
+        f"{dropped_rows:4d} dropped rows  {elapsed_sec:6.2f} sec  {100 * cpu_sec / elapsed_sec:5.1f}% CPU"
+    )
+
+def benchmark_scan_control(teensy:SimulatedTeensy, args):
+    scan_control = ImageScanControl()
+    scan_control.set_axis_frequency("stage", args.slow_axis, args.fast_axis, args.sampling_frequency)
+    if args.zero_copy:
+        scan_control.allocate_ring_buffer()
+
+    bytes_per_row, rows_per_scan = scan_control.data_buffer_resolution
+
+    for index in range(args.scans):
+        scan_control.start_scan()
+
+        num_bytes = 0
+        rows = 0
+        short_rows = 0
+        start_time = time.time()
+        start_cpu = time.process_time()
+        end_time = start_time
+
+        while True:
+            buffer = scan_control.read_data()
+            if buffer is None:
+                break
+
+            # The last read waits for the read timeout, so it isn't counted
+            end_time = time.time()
+            num_bytes += len(buffer)
+            if len(buffer) == bytes_per_row:
+                rows += 1
+            else:
+                short_rows += 1
+
+        print_scan(index, num_bytes, rows, rows_per_scan, short_rows, end_time - start_time,
+                   time.process_time() - start_cpu)
+
+def benchmark_video_feed(teensy:SimulatedTeensy, args):
+    # Creates the web app's components, which connect to the simulated Teensy
+    from webapp import video_feed_handler, event_stream
+
+    # The web app adds its own log sinks
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    video_feed_handler.set_axis_frequency("stage", args.slow_axis, args.fast_axis, args.sampling_frequency)
+
+    events = event_stream.subscribe()
+
+    # Frames are only rendered while a client is streaming
+    client_running = True
+    def thread_client():
+        subscription = video_feed_handler.subscribe()
+        while client_running:
+            video_feed_handler.get_frame(subscription)
+        video_feed_handler.unsubscribe(subscription)
+
+    client = threading.Thread(target=thread_client, name="BenchmarkClient")
+    client.daemon = True
+    client.start()
+
+    render_times = []
+    scans = 0
+    start_sequence = video_feed_handler.broadcaster.sequence
+    start_cpu = time.process_time()
+    scan_cpu = start_cpu
+
+    video_feed_handler.start()
+
+    while scans < args.scans:
+        event = events.get(timeout=10)
+        if event is None:
+            print("No events received. Is the simulated Teensy streaming?")
+            break
+
+        event_type, data = event
+        if event_type == "render":
+            render_times.append(data["render_ms_mean"])
+        elif event_type == "scan_complete":
+            cpu = time.process_time()
+            print_scan(scans, data["bytes_read"], data["rows_received"] - data["short_rows"],
+                       data["rows_per_scan"], data["short_rows"], data["elapsed_sec"], cpu - scan_cpu)
+            scan_cpu = cpu
+            scans += 1
+
+    video_feed_handler.pause()
+    client_running = False
+    event_stream.unsubscribe(events)
+
+    frames = video_feed_handler.broadcaster.sequence - start_sequence
+    if frames:
+        print(f"Frames: {frames}  CPU per frame: {1000 * (time.process_time() - start_cpu) / frames:.2f} ms (whole process)")
+    if render_times:
+        print(f"Render time: {sum(render_times) / len(render_times):.2f} ms (mean)")
+
+def main():
+    args = parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    recording = None
+    if args.recording:
+        with open(args.recording, "rb") as f:
+            recording = f.read()
+
+    teensy = SimulatedTeensy(args.baudrate, recording=recording, line_rate=args.line_rate)
+    ImageScanControl.DATA_DEVICE_NAME = teensy.data_device_name
+    ImageScanControl.CONTROL_DEVICE_NAME = teensy.control_device_name
+    ImageScanControl.DATA_BAUDRATE = args.baudrate
+
+    print(f"Simulated Teensy on {teensy.data_device_name} (data) and {teensy.control_device_name} (control)")
+    print(f"Streaming {args.sampling_frequency:.0f} samples/s at {args.baudrate:.0f} baud "
+          f"({'line rate' if args.line_rate else 'sampling frequency'})")
+
+    if args.target == "scan_control":
+        benchmark_scan_control(teensy, args)
+    else:
+        benchmark_video_feed(teensy, args)
+
+    print(f"Bytes sent: {teensy.bytes_sent}  dropped by the simulated UART: {teensy.bytes_dropped}")
+    teensy.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+Simulated Teensy
+================
+
+Stands in for the Teensy running firmware/mwCtrl, so the acquisition path can be run on
+a plain Linux machine without any hardware.
+
+Two pseudo-terminals replace the serial ports: the control port receives the same
+commands as the firmware (ie. 's' to set the frequencies, 'r' to run a scan, 'c' to run
+a calibration and 'k' to stop), and the data port streams one byte per sample for a
+full slow axis period.
+
+Samples are streamed at the sampling frequency, limited by the baud rate of the data
+port (ie. 8N1 framing takes 10 bits per byte). Like a real UART, samples which don't fit
+in the receive buffer (ie. because the reader fell behind) are dropped and counted.
+"""
+import os
+import re
+import pty
+import tty
+import time
+import select
+import threading
+
+import numpy as np
+from loguru import logger
+
+class SimulatedTeensy(object):
+    # Bits sent per byte on the data port (start bit, 8 data bits and stop bit)
+    BITS_PER_BYTE = 10
+
+    # Time between writes to the data port
+    WRITE_INTERVAL_SEC = 0.001
+
+    # Comma separated frequencies following the 's' command
+    FREQUENCIES_PATTERN = re.compile(rb"^s([-+0-9.,eE ]*)")
+
+    def __init__(self, baudrate:float=2e6, recording:bytes=None, line_rate:bool=False):
+        """
+        Args:
+            baudrate (float, optional): Baud rate of the data port. Defaults to 2e6.
+            recording (bytes, optional): Samples to replay (ie. raw data saved from a
+            real scan), repeated as needed. Defaults to None (ie. a synthetic image).
+            line_rate (bool, optional): Stream as fast as the baud rate allows instead of
+            at the sampling frequency (ie. to find the maximum ingest rate). Defaults to
+            False.
+        """
+        self.baudrate = baudrate
+        self.line_rate = line_rate
+
+        self._recording = np.frombuffer(recording, dtype=np.uint8) if recording else None
+
+        # Frequencies in the order sent by ImageScanControl.set_axis_frequency
+        self.stage_fast_axis_hz = 0.0
+        self.stage_slow_axis_hz = 0.0
+        self.beam_fast_axis_hz = 0.0
+        self.beam_slow_axis_hz = 0.0
+        self.sampling_frequency_hz = 0.0
+
+        self.bytes_sent = 0
+        self.bytes_dropped = 0
+        self.scans_started = 0
+
+        self._lock = threading.Lock()
+        self._scan = None  # samples of the scan being streamed
+        self._scan_position = 0
+
+        self._data_master, self._data_slave = self._open_pty()
+        self._control_master, self._control_slave = self._open_pty()
+
+        # Drop samples instead of blocking once the receive buffer is full
+        os.set_blocking(self._data_master, False)
+
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._thread_control, name="SimulatedTeensyControl"),
+            threading.Thread(target=self._thread_data, name="SimulatedTeensyData"),
+        ]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    @staticmethod
+    def _open_pty():
+        master, slave = pty.openpty()
+        # No line editing or newline translation, the data is binary
+        tty.setraw(slave)
+        return master, slave
+
+    @property
+    def data_device_name(self) -> str:
+        """Device name of the data port (ie. instead of /dev/ttyS0)"""
+        return os.ttyname(self._data_slave)
+
+    @property
+    def control_device_name(self) -> str:
+        """Device name of the control port (ie. instead of /dev/ttyACM0)"""
+        return os.ttyname(self._control_slave)
+
+    @property
+    def bytes_per_sec(self) -> float:
+        """Rate at which samples are streamed"""
+        max_rate = self.baudrate / self.BITS_PER_BYTE
+        if self.line_rate:
+            return max_rate
+
+        return min(self.sampling_frequency_hz, max_rate)
+
+    def close(self):
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+
+        for fd in (self._data_master, self._data_slave, self._control_master, self._control_slave):
+            os.close(fd)
+
+    def _generate_scan(self, slow_axis_hz:float, fast_axis_hz:float) -> np.ndarray:
+        """Returns the samples of one slow axis period"""
+        num_samples = int(self.sampling_frequency_hz / slow_axis_hz)
+
+        if self._recording is not None:
+            repeats = -(-num_samples // len(self._recording))
+            return np.tile(self._recording, repeats)[:num_samples]
+
+        # Concentric rings, so misaligned rows are easy to spot when viewing the scan
+        t = np.arange(num_samples) / self.sampling_frequency_hz
+        x = 2 * np.abs((t * fast_axis_hz) % 1 - 0.5)
+        y = 2 * np.abs((t * slow_axis_hz) % 1 - 0.5)
+        r = np.hypot(x - 0.5, y - 0.5)
+
+        return (127.5 * (1 + np.cos(40 * r))).astype(np.uint8)
+
+    def _execute(self, command:bytes) -> int:
+        """Executes the command at the start of the buffer
+
+        Returns:
+            int: Number of bytes used, or 0 if the command isn't complete yet
+        """
+        name = command[:1]
+
+        if name == b"s":
+            match = self.FREQUENCIES_PATTERN.match(command)
+            if match.end() == len(command):
+                # The firmware reads until the line goes quiet, so wait for more
+                return 0
+
+            values = [float(v) for v in match.group(1).split(b",") if v.strip()]
+            values += [0.0] * (5 - len(values))
+            (self.stage_fast_axis_hz, self.stage_slow_axis_hz, self.beam_fast_axis_hz,
+             self.beam_slow_axis_hz, self.sampling_frequency_hz) = values[:5]
+            logger.debug(f"Simulated Teensy: Set frequencies {values[:5]}")
+
+            return match.end()
+
+        if name in (b"r", b"c"):
+            if name == b"r":
+                scan = self._generate_scan(self.stage_slow_axis_hz, self.stage_fast_axis_hz)
+            else:
+                scan = self._generate_scan(self.beam_slow_axis_hz, self.beam_fast_axis_hz)
+
+            with self._lock:
+                self._scan = scan
+                self._scan_position = 0
+                self.scans_started += 1
+        elif name == b"k":
+            with self._lock:
+                self._scan = None
+        elif name == b"p":
+            os.write(self._control_master, b"A")
+
+        return 1
+
+    def _thread_control(self):
+        buffer = b""
+
+        while self._running:
+            readable, _, _ = select.select([self._control_master], [], [], 0.1)
+            if readable:
+                buffer += os.read(self._control_master, 1024)
+            elif buffer.startswith(b"s"):
+                # Line went quiet, so the frequencies are complete
+                buffer += b"\n"
+
+            while buffer:
+                used = self._execute(buffer)
+                if used == 0:
+                    break
+                buffer = buffer[used:].lstrip(b"\n")
+
+    def _thread_data(self):
+        next_write_time = time.monotonic()
+        pending = 0.0  # fractional bytes carried to the next write
+
+        while self._running:
+            next_write_time += self.WRITE_INTERVAL_SEC
+            time.sleep(max(next_write_time - time.monotonic(), 0))
+
+            with self._lock:
+                if self._scan is None:
+                    pending = 0.0
+                    next_write_time = time.monotonic()
+                    continue
+
+                pending += self.bytes_per_sec * self.WRITE_INTERVAL_SEC
+                num_bytes = min(int(pending), len(self._scan) - self._scan_position)
+                pending -= num_bytes
+
+                chunk = self._scan[self._scan_position:self._scan_position + num_bytes]
+                self._scan_position += num_bytes
+                if self._scan_position == len(self._scan):
+                    self._scan = None
+
+            if num_bytes == 0:
+                continue
+
+            try:
+                written = os.write(self._data_master, chunk.tobytes())
+            except BlockingIOError:
+                written = 0
+
+            self.bytes_sent += written
+            self.bytes_dropped += num_bytes - written
@@ -1,15 +1,20 @@
 import os
+import sys
 import configparser
 import logging
 from loguru import logger
 
 from flask import Flask, render_template
 
-from webapp.configs import LOG_FILE_PATH
+from webapp.configs import LOG_FILE_PATH, get_setting
 from webapp.utils.video_feed import VideoFeed
-"""from awesem.high_voltage_control import HighVoltageControl
-from awesem.laser_control import LaserControl"""
+from webapp.utils.telemetry_sampler import TelemetrySampler
+from webapp.utils.event_stream import EventStream
+from awesem.high_voltage_control import HighVoltageControl
+"""from awesem.laser_control import LaserControl"""
 from awesem.detector_amplifier_control import DetectorAmplifierControl
+from awesem.drivers.digital_potentiometers import DigitalPotentiometers
+from awesem.image_scan_process import ImageScanProcess, start_reader_process
 
 class InterceptHandler(logging.Handler):
     """Intercepts the default flask logger with loguru's logger
@@ -60,13 +65,46 @@ def create_app():
 
     return app
 
-logger.add(LOG_FILE_PATH, level="DEBUG", rotation="5 MB", retention="14 days")
+# The reader process is forked, so it's started before any threads exist (ie. the log
+# sinks' and the hardware handlers' threads). Requires python 3.8 or greater.
+if get_setting("Acquisition", "ReaderProcess", bool) and ImageScanProcess.is_supported():
+    start_reader_process()
+
+# Sinks are written from a background thread (enqueue), so logging never blocks the
+# acquisition thread on a slow terminal or SD card
+log_level = get_setting("Logging", "Level")
+logger.remove()
+logger.add(sys.stderr, level=log_level, enqueue=True)
+logger.add(LOG_FILE_PATH, level=log_level, rotation="5 MB", retention="14 days", enqueue=True)
 logger.debug(f"Using log file {LOG_FILE_PATH}")
 logger.info("Loading web app")
 
-video_feed_handler = VideoFeed()
-""" high_voltage_control_handler = HighVoltageControl()
-laser_control_handler = LaserControl()"""
+# Pushes scan state and acquisition statistics to the web page
+event_stream = EventStream()
+
+video_feed_handler = VideoFeed(event_stream)
+high_voltage_control_handler = HighVoltageControl()
+""" laser_control_handler = LaserControl()"""
 detector_amplifier_handler = DetectorAmplifierControl()
+digital_potentiometers_handler = DigitalPotentiometers(
+    verify_writes=get_setting("DigitalPotentiometers", "VerifyWrites", bool)
+)
+if get_setting("DigitalPotentiometers", "ReadBackOnStartup", bool):
+    digital_potentiometers_handler.read_wiper_positions()
+
+# Readings are served from memory, so polling the web app never touches the bus
+beam_control_telemetry = TelemetrySampler(
+    lambda: high_voltage_control_handler.get_ultravolt_output(
+        num_samples=get_setting("Telemetry", "SamplesPerReading", int),
+        use_kilovolts=True,
+        use_microamps=True
+    ),
+    ("voltage", "voltage_std", "current", "current_std"),
+    period_sec=get_setting("Telemetry", "SamplePeriodSec", float),
+    history_length=get_setting("Telemetry", "HistoryLength", int),
+    on_sample=lambda reading: event_stream.publish(
+        "beam_control", voltage=reading["voltage"], current=reading["current"]
+    )
+)
 
 logger.info("All web app components loaded.")
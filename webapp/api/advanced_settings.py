@@ -1,8 +1,8 @@
 from loguru import logger
 from flask import Blueprint, jsonify, make_response, request, send_from_directory
 
-from webapp.configs import config, save_config
-from webapp import video_feed_handler
+from webapp.configs import get_setting, set_setting
+from webapp import video_feed_handler, digital_potentiometers_handler, high_voltage_control_handler
 
 bp = Blueprint("api_settings", __name__)
 
@@ -11,8 +11,7 @@ def set_input_voltage_control_signal():
     value = request.get_json()["value"]
     logger.info(f"Set voltage signal to {value}")
 
-    config["BeamControl"]["VoltageControlSignalVolts"] = str(value)
-    save_config()
+    set_setting("BeamControl", "VoltageControlSignalVolts", value)
 
     high_voltage_control_handler.set_ultravolt_output_control_signal(value)
 
@@ -25,8 +24,7 @@ def set_stage_fast_axis_scan_rate():
     value = request.get_json()["value"]
     logger.info(f"Set fast axis scan rate to {value}")
 
-    config["ScanningStage"]["FastAxisScanRateHz"] = str(value)
-    save_config()
+    set_setting("ScanningStage", "FastAxisScanRateHz", value)
     
     return jsonify(success=True)
 
@@ -35,8 +33,7 @@ def set_stage_slow_axis_scan_rate():
     value = request.get_json()["value"]
     logger.info(f"Set slow axis scan rate to {value}")
 
-    config["ScanningStage"]["SlowAxisScanRateHz"] = str(value)
-    save_config()
+    set_setting("ScanningStage", "SlowAxisScanRateHz", value)
 
     return jsonify(success=True)
 
@@ -50,10 +47,9 @@ def set_stage_custom_fast_axis_scan_rate():
     # slow = (2.0*value) / (4*resolution)
     logger.info(f"Set custom fast axis scan rate to {value}")
 
-    config["ScanningStage.Custom"]["FastAxisScanRateHz"] = str(value)
-    # config["ScanningStage.Custom"]["SlowAxisScanRateHz"] = str(slow)
-    # config["ScanningStage.Custom"]["SamplingFrequencyHz"] = str(sampling)
-    save_config()
+    set_setting("ScanningStage.Custom", "FastAxisScanRateHz", value)
+    # set_setting("ScanningStage.Custom", "SlowAxisScanRateHz", slow)
+    # set_setting("ScanningStage.Custom", "SamplingFrequencyHz", sampling)
 
     return jsonify(success=True)
 
@@ -62,8 +58,7 @@ def set_stage_custom_slow_axis_scan_rate():
     value = request.get_json()["value"]
     logger.info(f"Set custom slow axis scan rate to {value}")
 
-    config["ScanningStage.Custom"]["SlowAxisScanRateHz"] = str(value)
-    save_config()
+    set_setting("ScanningStage.Custom", "SlowAxisScanRateHz", value)
 
     return jsonify(success=True)
 
@@ -72,8 +67,7 @@ def set_stage_custom_sampling_frequency():
     value = request.get_json()["value"]
     logger.info(f"Set custom sampling frequenncy to {value}")
 
-    config["ScanningStage.Custom"]["SamplingFrequencyHz"] = str(value)
-    save_config()
+    set_setting("ScanningStage.Custom", "SamplingFrequencyHz", value)
 
     return jsonify(success=True)
 
@@ -82,8 +76,7 @@ def set_beam_fast_axis_scan_rate():
     value = request.get_json()["value"]
     logger.info(f"Set fast axis scan rate to {value}")
 
-    config["BeamAlignment"]["FastAxisScanRateHz"] = str(value)
-    save_config()
+    set_setting("BeamAlignment", "FastAxisScanRateHz", value)
 
     return jsonify(success=True)
 
@@ -92,8 +85,7 @@ def set_beam_slow_axis_scan_rate():
     value = request.get_json()["value"]
     logger.info(f"Set slow axis scan rate to {value}")
 
-    config["BeamAlignment"]["SlowAxisScanRateHz"] = str(value)
-    save_config()
+    set_setting("BeamAlignment", "SlowAxisScanRateHz", value)
 
     return jsonify(success=True)
 
@@ -102,10 +94,10 @@ def set_resolution():
     value = request.get_json()["value"]
     logger.info(f"Set the image resolution to: {value}")
 
-    config["User.ScanSettings"]["Resolution"] = str(value)
-    save_config()
+    set_setting("User.ScanSettings", "Resolution", value)
+    video_feed_handler.visualize.set_resolution()
 
-    fast_axis_hz = config["ScanningStage"].getfloat("FastAxisScanRateHz")
+    fast_axis_hz = get_setting("ScanningStage", "FastAxisScanRateHz", float)
     sampling_frequency_hz = 2*(4*value)*fast_axis_hz
     slow_axis_hz = (2.0*fast_axis_hz) / (4*value)
 
@@ -121,8 +113,7 @@ def set_detector_bias():
     value = request.get_json()["value"]
     logger.info(f"Set detector bias to {value}")
 
-    config["Detector"]["BiasVolts"] = str(value)
-    save_config()
+    set_setting("Detector", "BiasVolts", value)
 
     detector_amplifier_handler.set_detector_bias(value)
 
@@ -133,7 +124,11 @@ def set_brightness_map():
     value = request.get_json()["value"]
     logger.info(f"Set brightness map to {value}")
 
-    config["BeamAlignment"]["MapEnabled"] = str(value)
-    save_config()
+    set_setting("BeamAlignment", "MapEnabled", value)
 
     return jsonify(success=True)
+
+@bp.route("/get_wiper_positions", methods=["GET"])
+def get_wiper_positions():
+    """Returns the last known position of each digital potentiometer wiper"""
+    return jsonify(wipers=digital_potentiometers_handler.get_wiper_positions())
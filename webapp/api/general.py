@@ -1,29 +1,39 @@
 import time
 
 from loguru import logger
-from flask import Blueprint, jsonify, make_response, request, send_from_directory
+from flask import Blueprint, Response, jsonify, make_response, request, send_from_directory
 
 # from awesem.drivers.relays import State
 
-from webapp import video_feed_handler, detector_amplifier_handler
-from webapp.configs import config, save_config
+from webapp import video_feed_handler, detector_amplifier_handler, beam_control_telemetry, event_stream
+from webapp.configs import get_setting, set_setting, LOG_FILE_PATH
+from webapp.utils.jobs import JobRegistry
+from webapp.utils.log_reader import LogReader
 
 bp = Blueprint("api_general", __name__)
 
+# Maximum time a status request waits for a job to progress
+LONG_POLL_TIMEOUT_SEC = 20
+
+# Time between comments sent on an idle event stream, so disconnected clients are noticed
+EVENT_KEEPALIVE_SEC = 15
+
+jobs = JobRegistry()
+
 def apply_slider_settings():
     """Applies slider settings to relevant hardware controls
     """
     logger.debug("Applying slider settings")
 
-    magnify  = config["User.ScanSettings"].getfloat("Magnify")
+    magnify  = get_setting("User.ScanSettings", "Magnify", float)
     video_feed_handler.scan_control_handler.set_scan_amplitude(magnify)
     logger.debug(f"Magnify slider: {magnify} V")
 
-    brightness = config["User.ScanSettings"].getfloat("Brightness")
+    brightness = get_setting("User.ScanSettings", "Brightness", float)
     detector_amplifier_handler.set_output_gain(brightness)
     logger.debug(f"Brightness slider: {brightness} V")
 
-    contrast = config["User.ScanSettings"].getfloat("Contrast")
+    contrast = get_setting("User.ScanSettings", "Contrast", float)
     video_feed_handler.visualize.set_contrast(contrast)
     logger.debug(f"Contrast slider: {contrast} bits")
 
@@ -38,8 +48,7 @@ def electron_beam_on():
 #         config["BeamControl"].getfloat("VoltageControlSignalVolts")
 #     )
 #     laser_control_handler.power(State.ON)
-    config["General"]["IsPoweredOn"] = str(True)
-    save_config()
+    set_setting("General", "IsPoweredOn", True)
 
     logger.info("All systems powered on")
 
@@ -60,8 +69,7 @@ def electron_beam_off():
 
     video_feed_handler.stop()
 
-    config["General"]["IsPoweredOn"] = str(False)
-    save_config()
+    set_setting("General", "IsPoweredOn", False)
 
     logger.info("All systems powered off")
 
@@ -69,28 +77,100 @@ def electron_beam_off():
 
 @bp.route("/electron_beam_align", methods=["POST"])
 def electron_beam_align():
+    """Starts the beam alignment in the background and replies with its job. The job is
+    followed with electron_beam_align_status.
+    """
+    job = video_feed_handler.calibration_job
+    if video_feed_handler.is_calibrating and job is not None and not job.is_done:
+        logger.info("Electron beam is already being calibrated")
+        return jsonify(success=True, **job.to_dict())
+
     apply_slider_settings()
 
     logger.info("Calibrating electron beam...")
-    video_feed_handler.run_calibration()
+    job = jobs.create("electron_beam_align")
+    video_feed_handler.run_calibration(job)
 
-    # Don't reply until calibration is complete
-    while True:
-        if not video_feed_handler.is_calibrating:
-            break
-        time.sleep(0.5)
+    return jsonify(success=True, **job.to_dict())
 
-    logger.info("Calibration complete")
+@bp.route("/electron_beam_align/<job_id>", methods=["GET"])
+def electron_beam_align_status(job_id):
+    """Replies with the status of a beam alignment job once it's done or has progressed
+    past version `since` (ie. long-polling), or after `timeout` seconds.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return make_response(jsonify(success=False, message=f"Unknown job {job_id}"), 404)
 
-    return jsonify(success=True)
+    since_version = request.args.get("since", type=int)
+    timeout = min(request.args.get("timeout", LONG_POLL_TIMEOUT_SEC, type=float), LONG_POLL_TIMEOUT_SEC)
+
+    job.wait(since_version, timeout)
+
+    return jsonify(success=True, **job.to_dict())
 
 @bp.route("/get_beam_control_output", methods=["GET"])
 def get_beam_control_output():
-     voltage = 1
-     current = 1
+    reading = beam_control_telemetry.latest()
+    if reading is None:
+        return jsonify(voltage="--", current="--")
 
     # Format as string to consistently show decimals
-     return jsonify(voltage="%.2f"%voltage, current="%.2f"%current)
+    return jsonify(voltage="%.2f"%reading["voltage"], current="%.2f"%reading["current"])
+
+@bp.route("/get_beam_control_history", methods=["GET"])
+def get_beam_control_history():
+    """Returns the voltage (kV) and current (uA) of the last `window` seconds, with at
+    most `points` values each
+    """
+    window_sec = request.args.get("window", 60.0, type=float)
+    max_points = request.args.get("points", 120, type=int)
+
+    return jsonify(beam_control_telemetry.history(window_sec, max_points))
+
+@bp.route("/events", methods=["GET"])
+def events():
+    """Streams the scan state, acquisition statistics and beam control readings as
+    server-sent events
+    """
+    def generate():
+        subscription = event_stream.subscribe()
+        try:
+            while True:
+                event = subscription.get(timeout=EVENT_KEEPALIVE_SEC)
+                if subscription.closed:
+                    break
+
+                if event is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield event_stream.format(*event)
+        finally:
+            event_stream.unsubscribe(subscription)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@bp.route("/logs", methods=["GET"])
+def logs():
+    """Returns the last `lines` lines of the log file, or the lines written since the
+    `since` offset of a previous response. Lines below `level` (ie. INFO) are left out.
+    """
+    num_lines = request.args.get("lines", 250, type=int)
+    since = request.args.get("since", type=int)
+    level = request.args.get("level")
+
+    reader = LogReader(LOG_FILE_PATH)
+    try:
+        if since is None:
+            result = reader.tail(num_lines, level)
+        else:
+            result = reader.read_since(since, level)
+    except ValueError:
+        return make_response(jsonify(success=False, message=f"Unknown log level {level}"), 400)
+
+    return jsonify(result)
 
 @bp.route("/start_stream", methods=["POST"])
 def start_stream():
@@ -116,8 +196,7 @@ def set_image_setting_magnify():
     value = 3.3 - request.get_json()["value"] / 100
     logger.info(f"Set magnify to {value}")
 
-    config["User.ScanSettings"]["Magnify"] = str(value)
-    save_config()
+    set_setting("User.ScanSettings", "Magnify", value)
 
     video_feed_handler.scan_control_handler.set_scan_amplitude(value)
 
@@ -129,8 +208,7 @@ def set_image_setting_brightness():
     value = request.get_json()["value"] / 100
     logger.info(f"Set brightness to {value}")
 
-    config["User.ScanSettings"]["Brightness"] = str(value)
-    save_config()
+    set_setting("User.ScanSettings", "Brightness", value)
 
     detector_amplifier_handler.set_output_gain(value)
 
@@ -141,8 +219,7 @@ def set_image_setting_contrast():
     value = request.get_json()["value"]
     logger.info(f"Set contrast to {value}")
 
-    config["User.ScanSettings"]["Contrast"] = str(value)
-    save_config()
+    set_setting("User.ScanSettings", "Contrast", value)
 
     video_feed_handler.visualize.set_contrast(value)
 
@@ -152,11 +229,10 @@ def set_image_setting_contrast():
 def set_scan_rate():
     key = request.get_json()["key"]
 
-    fast_axis_hz = config[f"ScanningStage.{key}"].getfloat("FastAxisScanRateHz")
-    config["ScanningStage"]["FastAxisScanRateHz"] = str(fast_axis_hz) #to be referenced globally
-    save_config()
+    fast_axis_hz = get_setting(f"ScanningStage.{key}", "FastAxisScanRateHz", float)
+    set_setting("ScanningStage", "FastAxisScanRateHz", fast_axis_hz) #to be referenced globally
 
-    resolution = config["User.ScanSettings"].getfloat("Resolution")
+    resolution = get_setting("User.ScanSettings", "Resolution", float)
     sampling_frequency_hz = 2*(4*resolution)*fast_axis_hz
     slow_axis_hz = (2.0*fast_axis_hz) / (4*resolution)
 
@@ -1,4 +1,7 @@
 import os
+import atexit
+import tempfile
+import threading
 import configparser
 
 from loguru import logger
@@ -20,10 +23,107 @@ if not os.path.exists(WEBAPP_FILE_DIRECTORY):
 if not os.path.exists(LOG_DIRECTORY):
     os.makedirs(LOG_DIRECTORY)
 
+# Changes are coalesced into one write per window, since sliders can send dozens of
+# changes per second
+SAVE_DELAY_SEC = 2.0
+
+_config_lock = threading.RLock()
+_save_timer = None
+_setting_cache = {}
+
+def get_setting(section:str, key:str, value_type=str):
+    """Returns a setting converted to the given type. Converted values are cached until
+    the setting is changed with set_setting.
+
+    Args:
+        section (str): Config section (ie. 'User.ScanSettings')
+        key (str): Setting in the section (ie. 'Resolution')
+        value_type (optional): One of str, int, float or bool. Defaults to str.
+    """
+    cache_key = (section, key, value_type)
+
+    try:
+        return _setting_cache[cache_key]
+    except KeyError:
+        pass
+
+    with _config_lock:
+        if value_type is bool:
+            value = config[section].getboolean(key)
+        elif value_type is str:
+            value = config[section][key]
+        else:
+            value = value_type(config[section].getfloat(key))
+
+        _setting_cache[cache_key] = value
+
+    return value
+
+def set_setting(section:str, key:str, value, save=True):
+    """Applies a setting immediately, and saves it to file after SAVE_DELAY_SEC.
+
+    Args:
+        section (str): Config section (ie. 'User.ScanSettings')
+        key (str): Setting in the section (ie. 'Resolution')
+        value: New value, stored as a string
+        save (bool, optional): Whether to save the config to file. Defaults to True.
+    """
+    with _config_lock:
+        config[section][key] = str(value)
+
+        for cache_key in [k for k in _setting_cache if k[:2] == (section, key)]:
+            del _setting_cache[cache_key]
+
+    if save:
+        save_config()
+
 def save_config():
-    """Saves all current values tof ile
+    """Saves all current values to file. Saves are coalesced, so the file is written
+    once SAVE_DELAY_SEC after the first unsaved change.
+    """
+    global _save_timer
+
+    with _config_lock:
+        if _save_timer is not None:
+            return
+
+        _save_timer = threading.Timer(SAVE_DELAY_SEC, flush_config)
+        _save_timer.daemon = True
+        _save_timer.start()
+
+def flush_config():
+    """Saves all current values to file immediately. The file is replaced atomically,
+    so it's never left half written (ie. if the power is cut).
     """
-    with open(CONFIG_FILE, 'w') as configfile:
-        config.write(configfile)
+    global _save_timer
+
+    with _config_lock:
+        if _save_timer is not None:
+            _save_timer.cancel()
+            _save_timer = None
+
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(CONFIG_FILE), prefix=".config-", suffix=".ini"
+        )
+        try:
+            with os.fdopen(file_descriptor, 'w') as configfile:
+                config.write(configfile)
+                configfile.flush()
+                os.fsync(configfile.fileno())
+
+            # Keep the permissions of the original file (mkstemp only allows the owner)
+            if os.path.exists(CONFIG_FILE):
+                os.chmod(temp_path, os.stat(CONFIG_FILE).st_mode & 0o777)
+
+            os.replace(temp_path, CONFIG_FILE)
+        except:
+            os.remove(temp_path)
+            raise
 
     logger.info(f"Saved to {CONFIG_FILE}")
+
+def _flush_pending_config():
+    if _save_timer is not None:
+        flush_config()
+
+atexit.register(_flush_pending_config)
@@ -12,12 +12,14 @@ var Index = {
         radioScanRates: document.getElementsByName("scanRates"),
         radioScanRateCustom: document.getElementById("scanRateCustom"),
         displayAccelerationVoltage: document.getElementById("displayAccelerationVoltage"),
+        displayScanStatus: document.getElementById("displayScanStatus"),
     },
 
     routes: {
         postElectronBeamOn: "/api/electron_beam_on",
         postElectronBeamOff: "/api/electron_beam_off",
         postElectronBeamAlign: "/api/electron_beam_align",
+        getElectronBeamAlign: "/api/electron_beam_align/",
         postStartStream: "/api/start_stream",
         postStopStream: "/api/pause_stream",
         postSaveScan: "/api/save_scan",
@@ -26,8 +28,13 @@ var Index = {
         postImageContrast: "/api/set_image_setting_contrast",
         postScanRate: "/api/set_scan_rate",
         getBeamControlOutput: "/api/get_beam_control_output",
+        getEvents: "/api/events",
     },
 
+    // Retries of a failed beam alignment status request, the delay doubles each time
+    alignStatusMaxRetries: 5,
+    alignStatusRetryDelayMs: 500,
+
     init: function() {
         this.bindUI();
         if (this.components.btnElectronBeamOn.innerText == "Power On") {
@@ -58,7 +65,8 @@ var Index = {
         this.components.radioScanRates[4].addEventListener("click", this.onScanRateClick.fastest);
         this.components.radioScanRates[5].addEventListener("click", this.onScanRateClick.custom);
 
-        setInterval(Index.getBeamControlOutput, 1000)
+        Index.getBeamControlOutput();
+        Index.subscribeEvents();
     },
 
     /**
@@ -140,12 +148,8 @@ var Index = {
             Index.components.btnStartScan.disabled = true;
 
             fetchPost(Index.routes.postElectronBeamAlign)
-            .then(function() {
-                Index.components.btnElectronBeamOn.disabled = false;
-                Index.components.btnElectronBeamAlign.disabled = false;
-                Index.components.btnStartScan.disabled = false;
-
-                alert("Beam alignment complete.")
+            .then(function(job) {
+                Index.waitForElectronBeamAlign(job);
             })
         }
         else {
@@ -153,6 +157,63 @@ var Index = {
         }
     },
 
+    /**
+     * Follow the beam alignment job until it's done. Each request returns as soon as the job
+     * has progressed, so the progress is shown without polling on a timer. Failed requests
+     * are retried with a backoff.
+     * @param {object} job Status returned by the server
+     * @param {number} retries Failed requests since the last status
+     */
+    waitForElectronBeamAlign: function(job, retries) {
+        retries = retries || 0;
+
+        if (job === undefined || job["status"] === undefined) {
+            // The alignment could not be started
+            Index.finishElectronBeamAlign("Beam alignment failed to start.");
+            return;
+        }
+
+        if (job["status"] == "running") {
+            var progress = job["progress"];
+            if (progress["rows_per_scan"]) {
+                var percent = Math.round(100 * progress["rows_received"] / progress["rows_per_scan"]);
+                Index.components.btnElectronBeamAlign.innerText = "Aligning " + percent + "%";
+            }
+
+            fetchGet(Index.routes.getElectronBeamAlign + job["job_id"] + "?since=" + job["version"])
+            .then(function(nextJob) {
+                if (nextJob !== undefined && nextJob["status"] !== undefined) {
+                    Index.waitForElectronBeamAlign(nextJob);
+                }
+                else if (retries < Index.alignStatusMaxRetries) {
+                    // Request failed, asks again for the same status after a delay
+                    setTimeout(function() {
+                        Index.waitForElectronBeamAlign(job, retries + 1);
+                    }, Index.alignStatusRetryDelayMs * Math.pow(2, retries));
+                }
+                else {
+                    Index.finishElectronBeamAlign("Lost track of the beam alignment, its status is unknown.");
+                }
+            })
+            return;
+        }
+
+        Index.finishElectronBeamAlign("Beam alignment " + job["status"] + ".");
+    },
+
+    /**
+     * Re-enables the controls disabled during the beam alignment and shows the outcome.
+     * @param {string} message
+     */
+    finishElectronBeamAlign: function(message) {
+        Index.components.btnElectronBeamAlign.innerText = "Align";
+        Index.components.btnElectronBeamOn.disabled = false;
+        Index.components.btnElectronBeamAlign.disabled = false;
+        Index.components.btnStartScan.disabled = false;
+
+        alert(message)
+    },
+
     onStartScanClick: function() {
         console.log("Start")
         $.post(Index.routes.postStartStream)
@@ -217,13 +278,47 @@ var Index = {
     },
 
     getBeamControlOutput: function() {
-        // Only update values if user is in the current tab
-        if ( document.hasFocus() ) {
-            fetchGet(Index.routes.getBeamControlOutput)
-            .then(function(response) {
-                Index.components.displayAccelerationVoltage.innerText = response["voltage"] + " kV";
-            });
-        }
+        fetchGet(Index.routes.getBeamControlOutput)
+        .then(function(response) {
+            Index.components.displayAccelerationVoltage.innerText = response["voltage"] + " kV";
+        });
+    },
+
+    /**
+     * Listen to the scan state and acquisition statistics pushed by the server, instead of
+     * polling for them. The browser reconnects automatically if the stream drops.
+     */
+    subscribeEvents: function() {
+        var events = new EventSource(Index.routes.getEvents);
+
+        events.addEventListener("beam_control", function(e) {
+            var data = JSON.parse(e.data);
+            Index.components.displayAccelerationVoltage.innerText = data["voltage"].toFixed(2) + " kV";
+        });
+
+        events.addEventListener("scan_state", function(e) {
+            var data = JSON.parse(e.data);
+            if (data["state"] != "running") {
+                Index.components.displayScanStatus.innerText = "Scan " + data["state"];
+            }
+        });
+
+        events.addEventListener("scan_progress", function(e) {
+            var data = JSON.parse(e.data);
+            var status = "Row " + data["rows_received"] + "/" + data["rows_per_scan"]
+                + ", " + (data["throughput_bytes_per_sec"] / 1000).toFixed(1) + " kB/s";
+            if (data["short_rows"] > 0) {
+                status += ", " + data["short_rows"] + " short rows";
+            }
+            Index.components.displayScanStatus.innerText = status;
+        });
+
+        events.addEventListener("scan_complete", function(e) {
+            var data = JSON.parse(e.data);
+            Index.components.displayScanStatus.innerText = "Scan complete in "
+                + data["elapsed_sec"].toFixed(2) + " sec, "
+                + (data["throughput_bytes_per_sec"] / 1000).toFixed(1) + " kB/s";
+        });
     },
 }
 
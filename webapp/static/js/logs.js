@@ -0,0 +1,70 @@
+var Logs = {
+    // Lines kept on the page while following the log
+    MAX_LINES: 2000,
+    // Time between requests for new lines
+    FOLLOW_INTERVAL_MS: 2000,
+
+    components: {
+        logs: document.getElementById("logs"),
+        selectLogLevel: document.getElementById("selectLogLevel"),
+        checkFollowLogs: document.getElementById("checkFollowLogs"),
+    },
+
+    routes: {
+        getLogs: "/api/logs",
+    },
+
+    init: function() {
+        this.offset = parseInt(this.components.logs.dataset.offset);
+        this.bindUI();
+        setInterval(Logs.followLogs, Logs.FOLLOW_INTERVAL_MS);
+    },
+
+    bindUI: function() {
+        this.components.selectLogLevel.addEventListener("change", this.onLogLevelChange);
+    },
+
+    onLogLevelChange: function() {
+        // Reload the page so the last lines are filtered server-side
+        window.location.search = "?level=" + Logs.components.selectLogLevel.value;
+    },
+
+    /**
+     * Append the lines written since the last request
+     */
+    followLogs: function() {
+        // Only update if user is in the current tab
+        if ( !Logs.components.checkFollowLogs.checked || !document.hasFocus() ) {
+            return;
+        }
+
+        var url = Logs.routes.getLogs + "?since=" + Logs.offset
+            + "&level=" + Logs.components.selectLogLevel.value;
+
+        fetchGet(url)
+        .then(function(response) {
+            if (response["reset"]) {
+                // The log file was rotated
+                Logs.components.logs.textContent = "";
+            }
+            Logs.offset = response["offset"];
+
+            if (response["lines"].length == 0) {
+                return;
+            }
+
+            var lines = Logs.components.logs.textContent.split("\n").filter(function(line) {
+                return line.length > 0;
+            });
+            lines = lines.concat(response["lines"]).slice(-Logs.MAX_LINES);
+            Logs.components.logs.textContent = lines.join("\n");
+
+            window.scrollTo(0, document.body.scrollHeight);
+        });
+    },
+}
+
+window.addEventListener("load", function() {
+    this.console.log("Loaded logs.js")
+    Logs.init();
+})
@@ -1,66 +1,161 @@
 import time
 import threading
-try:
-    from greenlet import getcurrent as get_ident
-except ImportError:
-    try:
-        from thread import get_ident
-    except ImportError:
-        from _thread import get_ident
 
 from loguru import logger
 
-class VideoFeedEvent(object):
-    """An Event-like class that signals all active clients when a new frame is
-    available.
+class FrameSubscription(object):
+    """Latest-frame slot of a single client.
+
+    The slot only holds the newest frame, so a client that's slower than the frame thread
+    skips frames instead of holding up the frame thread or the other clients.
+    """
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._frame = None
+        self._sequence = 0
+        self._closed = False
+
+        self.last_sequence = 0  # sequence number of the last frame read by the client
+        self.frames_skipped = 0  # total number of frames the client didn't keep up with
+        self.published_at = None  # time the unread frame was published, if any
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def publish(self, frame, sequence:int):
+        """Invoked by the frame thread to replace the frame in the slot."""
+        with self._condition:
+            if self.published_at is None:
+                self.published_at = time.time()
+            self._frame = frame
+            self._sequence = sequence
+            self._condition.notify_all()
+
+    def close(self):
+        """Wakes up the client, which then stops waiting for frames."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def wait(self, timeout:float=None):
+        """Invoked from the client's thread to wait for the next frame.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a frame. Defaults to forever.
+
+        Returns:
+            int, object: Sequence number and frame, or (None, None) if the subscription
+            was closed or the timeout expired
+        """
+        with self._condition:
+            has_frame = self._condition.wait_for(
+                lambda: self._closed or self._sequence != self.last_sequence,
+                timeout=timeout
+            )
+            if self._closed or not has_frame:
+                return None, None
+
+            if self.last_sequence and self._sequence - self.last_sequence > 1:
+                self.frames_skipped += self._sequence - self.last_sequence - 1
+
+            self.last_sequence = self._sequence
+            self.published_at = None
+
+            return self._sequence, self._frame
+
+    @property
+    def latest(self):
+        """Sequence number and frame last published to the client, read or not."""
+        with self._condition:
+            return self._sequence, self._frame
+
+
+class FrameBroadcaster(object):
+    """Signals all active clients when a new frame is available.
     """
+    # If a client hasn't read a frame for this long, assume the client is gone
+    STALE_CLIENT_SEC = 5
+
     def __init__(self):
-        self.events = {}
-
-    def wait(self):
-        """Invoked from each client's thread to wait for the next frame."""
-        ident = get_ident()
-        if ident not in self.events:
-            # this is a new client
-            # add an entry for it in the self.events dict
-            # each entry has two elements, a threading.Event() and a timestamp
-            self.events[ident] = [threading.Event(), time.time()]
-        return self.events[ident][0].wait()
-
-    def set(self):
-        """Invoked by the camera thread when a new frame is available."""
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._frame = None
+        self.sequence = 0
+
+    @property
+    def num_subscribers(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self) -> FrameSubscription:
+        """Invoked from a client's thread before waiting for frames. The client starts
+        with the latest frame, since a new one is only published once it has changed."""
+        subscription = FrameSubscription()
+
+        with self._lock:
+            if self._frame is not None:
+                subscription.publish(self._frame, self.sequence)
+            self._subscriptions.append(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription:FrameSubscription):
+        """Invoked from a client's thread when it stops streaming."""
+        subscription.close()
+
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, frame):
+        """Invoked by the frame thread when a new frame is available.
+
+        Returns:
+            int: Sequence number of the frame
+        """
         now = time.time()
-        remove = None
-        for ident, event in self.events.items():
-            if not event[0].isSet():
-                # if this client's event is not set, then set it
-                # also update the last set timestamp to now
-                event[0].set()
-                event[1] = now
-            else:
-                # if the client's event is already set, it means the client
-                # did not process a previous frame
-                # if the event stays set for more than 5 seconds, then assume
-                # the client is gone and remove it
-                if now - event[1] > 5:
-                    remove = ident
-        if remove:
-            del self.events[remove]
-
-    def clear(self):
-        """Invoked from each client's thread after a frame was processed."""
-        self.events[get_ident()][0].clear()
+
+        with self._lock:
+            self.sequence += 1
+            self._frame = frame
+
+            stale = [s for s in self._subscriptions
+                     if s.published_at is not None and now - s.published_at > self.STALE_CLIENT_SEC]
+            for subscription in stale:
+                self._subscriptions.remove(subscription)
+
+            subscriptions = list(self._subscriptions)
+
+        for subscription in stale:
+            logger.debug(f"Removing stale client which skipped {subscription.frames_skipped} frames.")
+            subscription.close()
+
+        for subscription in subscriptions:
+            subscription.publish(frame, self.sequence)
+
+        return self.sequence
 
 
 class BaseVideoFeed(object):
+    # Resend the last frame to clients if no new frame is published for this long, so
+    # disconnected clients are noticed while the frame doesn't change
+    KEEPALIVE_SEC = 2
+
     def __init__(self):
         """Start the background camera thread if it isn't running yet."""
         self.base_thread = None  # background thread that reads frames from camera
         self.frame = None  # current frame is stored here by background thread
         self.last_access = 0  # time of last client access to the camera
-        self.event = VideoFeedEvent()
+        self.broadcaster = FrameBroadcaster()
         self._request_stop_thread = False
 
+        # Encoded versions of the current frame, so clients streaming the same format
+        # share a single encode. Each format and quality has its own lock, so a slow
+        # encode (ie. WebP) doesn't hold up clients streaming another format.
+        self._encode_lock = threading.Lock()
+        self._encode_key_locks = {}   # (format, quality) -> lock
+        self._encoded = {}            # (format, quality) -> (sequence, encoded frame)
+
         if self.base_thread is None:
             self.last_access = time.time()
 
@@ -70,18 +165,63 @@ class BaseVideoFeed(object):
             self.base_thread.start()
 
             # wait until frames are available
-            while self.get_frame() is None:
+            subscription = self.subscribe()
+            while self.get_frame(subscription) is None:
                 time.sleep(0)
+            self.unsubscribe(subscription)
+
+    def subscribe(self) -> FrameSubscription:
+        """Registers a new client. Frames are read with get_frame."""
+        return self.broadcaster.subscribe()
+
+    def unsubscribe(self, subscription:FrameSubscription):
+        """Removes a client registered with subscribe."""
+        self.broadcaster.unsubscribe(subscription)
+
+    def get_frame(self, subscription:FrameSubscription, image_format=None, quality=None):
+        """Return the next camera frame, encoded in the given format.
 
-    def get_frame(self):
-        """Return the current camera frame."""
+        Returns None once the client has been removed (ie. for being too slow).
+        """
         self.last_access = time.time()
 
         # wait for a signal from the camera thread
-        self.event.wait()
-        self.event.clear()
+        while True:
+            sequence, frame = subscription.wait(timeout=self.KEEPALIVE_SEC)
+            if frame is not None:
+                break
+
+            if subscription.closed:
+                return None
+
+            sequence, frame = subscription.latest
+            if frame is not None:
+                break
+
+        return self._get_encoded_frame(frame, sequence, image_format, quality)
+
+    def _get_encoded_frame(self, frame, sequence, image_format, quality):
+        """Encodes the latest frame once per format and quality."""
+        # Only the latest frame is cached. Clients that are a frame behind encode their
+        # own copy.
+        if sequence < self.broadcaster.sequence:
+            return self.encode_frame(frame, image_format, quality)
+
+        key = (image_format, quality)
+        with self._encode_lock:
+            key_lock = self._encode_key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            encoded = self._encoded.get(key)
+            if encoded is None or encoded[0] != sequence:
+                encoded = (sequence, self.encode_frame(frame, image_format, quality))
+                self._encoded[key] = encoded
+
+            return encoded[1]
 
-        return self.frame
+    def encode_frame(self, frame, image_format=None, quality=None):
+        """Encodes a frame for streaming. Frames are streamed as is unless overridden."""
+        return frame
 
     def frames(self):
         """"Generator that returns frames from the camera."""
@@ -94,7 +234,7 @@ class BaseVideoFeed(object):
         frames_iterator = self.frames()
         for frame in frames_iterator:
             self.frame = frame
-            self.event.set()  # send signal to clients
+            self.broadcaster.publish(frame)  # send signal to clients
             time.sleep(0)
 
         self.base_thread = None
@@ -0,0 +1,100 @@
+import json
+import time
+import threading
+from collections import deque
+
+class EventSubscription(object):
+    """Bounded queue of the events for a single client. If the client falls behind, the
+    oldest events are dropped instead of holding up the publisher.
+    """
+    def __init__(self, max_events:int):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=max_events)
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def put(self, event:tuple):
+        with self._condition:
+            self._events.append(event)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get(self, timeout:float=None) -> tuple:
+        """Waits for the next event.
+
+        Returns:
+            tuple: Event type and data, or None if the timeout expired or the
+            subscription was closed
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self._closed, timeout=timeout)
+
+            if self._closed or not self._events:
+                return None
+
+            return self._events.popleft()
+
+
+class EventStream(object):
+    """Publishes events (ie. scan state and acquisition statistics) to all subscribed
+    clients, and formats them as server-sent events.
+    """
+    # Events kept per client before the oldest are dropped
+    MAX_EVENTS_PER_CLIENT = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+        # The last event of each type, so new clients start with the current state
+        self._last_events = {}
+
+    @property
+    def num_subscribers(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self) -> EventSubscription:
+        subscription = EventSubscription(self.MAX_EVENTS_PER_CLIENT)
+
+        with self._lock:
+            for event in self._last_events.values():
+                subscription.put(event)
+            self._subscriptions.append(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription:EventSubscription):
+        subscription.close()
+
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, event_type:str, **data):
+        """Sends an event to all clients. Never blocks on slow clients.
+
+        Args:
+            event_type (str): Name of the event (ie. 'scan_state')
+            data: JSON serializable values of the event
+        """
+        data["time"] = time.time()
+        event = (event_type, data)
+
+        with self._lock:
+            self._last_events[event_type] = event
+            subscriptions = list(self._subscriptions)
+
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    @staticmethod
+    def format(event_type:str, data:dict) -> str:
+        """Formats an event as a server-sent event"""
+        return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
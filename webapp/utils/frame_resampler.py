@@ -0,0 +1,178 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+class FrameResampler(object):
+    """Resamples the data matrix to the output image resolution.
+
+    The data matrix (ie. 1333x333) usually has a very different size and aspect from the
+    output image, so where each output pixel samples the data matrix is calculated once
+    on creation. Create a new instance whenever the data matrix shape, the output
+    resolution or the filter changes.
+
+    Nearest and box filters are applied in NumPy before colorization, so only the output
+    pixels are colored. The box filter averages all data pixels that fall in each output
+    pixel, which also denoises the image instead of just decimating it. The bilinear
+    filter is applied by PIL to the colored image.
+    """
+    # Sample the closest data pixel
+    FILTER_NEAREST = "Nearest"
+    # Average all data pixels within each output pixel (ie. binning)
+    FILTER_BOX = "Box"
+    # Interpolate between neighbouring data pixels
+    FILTER_BILINEAR = "Bilinear"
+
+    FILTERS = (FILTER_NEAREST, FILTER_BOX, FILTER_BILINEAR)
+
+    # Radius of data pixels read by PIL's bilinear filter (before scaling)
+    BILINEAR_SUPPORT = 1.0
+
+    def __init__(self, source_shape:tuple, output_size:tuple, resample_filter:str=FILTER_BOX):
+        """
+        Args:
+            source_shape (tuple): Shape (rows, columns) of the data matrix
+            output_size (tuple): Size (width, height) of the output image
+            resample_filter (str, optional): One of FILTERS. Defaults to FILTER_BOX.
+        """
+        if resample_filter not in self.FILTERS:
+            raise ValueError(f"Resample filter '{resample_filter}' not allowed. Please select one of {self.FILTERS}.")
+
+        self.source_shape = tuple(source_shape)
+        self.output_size = tuple(output_size)
+        self.resample_filter = resample_filter
+
+        height, width = self.source_shape
+        out_width, out_height = self.output_size
+
+        if resample_filter == self.FILTER_NEAREST:
+            self._row_index = self._nearest_index(height, out_height)
+            self._col_index = self._nearest_index(width, out_width)
+        elif resample_filter == self.FILTER_BOX:
+            # At most one bin per output pixel. When upscaling, each data pixel is its own
+            # bin and bins are repeated with the nearest filter.
+            self._row_edges = self._bin_edges(height, out_height)
+            self._col_edges = self._bin_edges(width, out_width)
+            self._row_index = self._nearest_index(len(self._row_edges) - 1, out_height)
+            self._col_index = self._nearest_index(len(self._col_edges) - 1, out_width)
+            self._row_counts = np.diff(self._row_edges)
+            self._col_counts = np.diff(self._col_edges)
+
+    @property
+    def colors_output(self) -> bool:
+        """True if the filter is applied before colorization (ie. only the output pixels
+        need to be colored)
+        """
+        return self.resample_filter != self.FILTER_BILINEAR
+
+    @staticmethod
+    def _nearest_index(source_length:int, output_length:int) -> np.ndarray:
+        """Index of the source pixel closest to the center of each output pixel
+        """
+        index = (np.arange(output_length) + 0.5) * (source_length / output_length)
+        return np.minimum(index.astype(np.intp), source_length - 1)
+
+    @staticmethod
+    def _bin_edges(source_length:int, output_length:int) -> np.ndarray:
+        """Edges of evenly spread bins of at least one source pixel each
+        """
+        num_bins = min(source_length, output_length)
+        return np.linspace(0, source_length, num_bins + 1).astype(np.intp)
+
+    def output_columns(self, start:int, stop:int):
+        """Returns the output columns that sample any of the given source columns.
+
+        Args:
+            start (int): First source column
+            stop (int): End of the source columns (exclusive)
+
+        Returns:
+            int, int: Start and stop of the output columns
+        """
+        width = self.source_shape[1]
+        out_width = self.output_size[0]
+
+        if start <= 0 and stop >= width:
+            return 0, out_width
+        if stop <= start:
+            return 0, 0
+
+        if self.resample_filter == self.FILTER_NEAREST:
+            return (
+                int(np.searchsorted(self._col_index, start, side='left')),
+                int(np.searchsorted(self._col_index, stop, side='left'))
+            )
+        elif self.resample_filter == self.FILTER_BOX:
+            first_bin = np.searchsorted(self._col_edges, start, side='right') - 1
+            last_bin = np.searchsorted(self._col_edges, stop - 1, side='right') - 1
+            return (
+                int(np.searchsorted(self._col_index, first_bin, side='left')),
+                int(np.searchsorted(self._col_index, last_bin, side='right'))
+            )
+
+        scale = width / out_width
+        support = self.BILINEAR_SUPPORT * max(scale, 1.0) + 1
+
+        return (
+            max(math.floor((start - support) / scale), 0),
+            min(math.ceil((stop + support) / scale), out_width)
+        )
+
+    def resample(self, img_array:np.ndarray, out_start:int, out_stop:int) -> np.ndarray:
+        """Samples the output columns from the data matrix with the nearest or box
+        filter.
+
+        Args:
+            img_array (np.ndarray): 2D uint8 data matrix
+            out_start (int): First output column
+            out_stop (int): End of the output columns (exclusive)
+
+        Returns:
+            np.ndarray: uint8 array of shape (output height, out_stop - out_start)
+        """
+        if self.resample_filter == self.FILTER_NEAREST:
+            columns = img_array.take(self._col_index[out_start:out_stop], axis=1)
+            return columns.take(self._row_index, axis=0)
+
+        # Only bin the source columns used by the output columns
+        bins = self._col_index[out_start:out_stop]
+        first_bin, end_bin = bins[0], bins[-1] + 1
+        col_start, col_stop = self._col_edges[first_bin], self._col_edges[end_bin]
+
+        sums = np.add.reduceat(img_array[:, col_start:col_stop], self._row_edges[:-1], axis=0, dtype=np.uint32)
+        sums = np.add.reduceat(sums, self._col_edges[first_bin:end_bin] - col_start, axis=1)
+
+        counts = np.outer(self._row_counts, self._col_counts[first_bin:end_bin])
+        means = ((sums + counts // 2) // counts).astype(np.uint8)
+
+        return means.take(bins - first_bin, axis=1).take(self._row_index, axis=0)
+
+    def resize(self, rgb:np.ndarray, out_start:int, out_stop:int) -> Image:
+        """Resizes the colored data matrix to the output columns with the bilinear
+        filter.
+
+        Args:
+            rgb (np.ndarray): Colored data matrix of shape (rows, columns, 3)
+            out_start (int): First output column
+            out_stop (int): End of the output columns (exclusive)
+
+        Returns:
+            Image: Image of the output columns
+        """
+        height, width = self.source_shape
+        out_width, out_height = self.output_size
+
+        scale = width / out_width
+        support = self.BILINEAR_SUPPORT * max(scale, 1.0) + 1
+
+        # Source area of the output columns, and the pixels the filter reads around it
+        box_start = out_start * scale
+        box_stop = out_stop * scale
+        crop_start = max(math.floor(box_start - support), 0)
+        crop_stop = min(math.ceil(box_stop + support), width)
+
+        return Image.fromarray(rgb[:, crop_start:crop_stop], 'RGB').resize(
+            (out_stop - out_start, out_height),
+            Image.BILINEAR,
+            box=(box_start - crop_start, 0, box_stop - crop_start, height)
+        )
@@ -0,0 +1,109 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+class Job(object):
+    """A long running task (ie. beam alignment) that clients can follow without
+    blocking on it.
+
+    Each progress update increments the job's version, so clients can wait for the next
+    update (ie. long-polling) instead of polling on a timer.
+    """
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETE = "complete"
+    STATUS_FAILED = "failed"
+    STATUS_ABORTED = "aborted"
+
+    def __init__(self, name:str):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = self.STATUS_RUNNING
+        self.progress = {}
+        self.version = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+        self._condition = threading.Condition()
+
+    @property
+    def is_done(self) -> bool:
+        return self.status != self.STATUS_RUNNING
+
+    def update(self, **progress):
+        """Updates the progress and wakes up waiting clients"""
+        with self._condition:
+            self.progress.update(progress)
+            self.version += 1
+            self._condition.notify_all()
+
+    def finish(self, status:str=STATUS_COMPLETE):
+        """Marks the job as done and wakes up waiting clients. Only the first call has an
+        effect.
+
+        Args:
+            status (str, optional): One of STATUS_COMPLETE, STATUS_FAILED or
+            STATUS_ABORTED. Defaults to STATUS_COMPLETE.
+        """
+        with self._condition:
+            if self.is_done:
+                return
+
+            self.status = status
+            self.finished_at = time.time()
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait(self, since_version:int=None, timeout:float=None) -> bool:
+        """Waits until the job is done, or until it has been updated after the given
+        version.
+
+        Args:
+            since_version (int, optional): Last version seen by the client. Defaults to
+            None (ie. only wait for the job to be done).
+            timeout (float, optional): Seconds to wait. Defaults to forever.
+
+        Returns:
+            bool: False if the timeout expired
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self.is_done or (since_version is not None and self.version > since_version),
+                timeout=timeout
+            )
+
+    def to_dict(self) -> dict:
+        with self._condition:
+            return {
+                "job_id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "version": self.version,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobRegistry(object):
+    """Keeps the most recent jobs so their status can be looked up by id"""
+    MAX_JOBS = 20
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def create(self, name:str) -> Job:
+        job = Job(name)
+
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.MAX_JOBS:
+                self._jobs.popitem(last=False)
+
+        return job
+
+    def get(self, job_id:str) -> Job:
+        """Returns the job, or None if it's unknown (or too old)"""
+        with self._lock:
+            return self._jobs.get(job_id)
@@ -0,0 +1,175 @@
+import os
+import re
+
+from loguru import logger
+
+class LogReader(object):
+    """Reads the end of the log file without loading all of it.
+
+    The log file can be several MB (ie. with DEBUG level logging), so the last lines are
+    found by reading blocks backwards from the end of the file, and clients following the
+    log only read what was written since their last request (ie. from a byte offset).
+
+    Lines are filtered by the level of their log entry. Lines which don't start a new entry
+    (ie. tracebacks) belong to the entry before them.
+    """
+    BLOCK_SIZE = 8192
+
+    # Maximum bytes read per request, so a filter matching nothing doesn't read the
+    # whole file
+    MAX_READ_BYTES = 1024 * 1024
+
+    # Start of a line written with loguru's default format (ie. "2020-01-01 12:00:00.000 | INFO     | ...")
+    ENTRY_PATTERN = re.compile(rb"^\d{4}-\d{2}-\d{2} [\d:.]+ \| (\w+)\s*\|")
+
+    def __init__(self, path:str):
+        self.path = path
+
+    @staticmethod
+    def get_level_number(level:str) -> int:
+        """Returns the severity of a level name (ie. 'INFO'), or None for no filter
+
+        Raises:
+            ValueError: If the level is unknown
+        """
+        if not level:
+            return None
+
+        return logger.level(level.upper()).no
+
+    def _get_entry_level(self, line:bytes) -> int:
+        """Returns the severity of the entry started by the line, or None if the line
+        continues the previous entry
+        """
+        match = self.ENTRY_PATTERN.match(line)
+        if match is None:
+            return None
+
+        try:
+            return logger.level(match.group(1).decode()).no
+        except ValueError:
+            return None
+
+    def _read_lines_backwards(self, f, end:int):
+        """Yields the complete lines before the end offset, last line first"""
+        position = end
+        remainder = b""
+
+        while position > 0 and end - position < self.MAX_READ_BYTES:
+            read_size = min(self.BLOCK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+
+            lines = (f.read(read_size) + remainder).split(b"\n")
+
+            # The first line may continue in the previous block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line
+
+        if position == 0 and remainder:
+            yield remainder
+
+    def tail(self, num_lines:int, level:str=None) -> dict:
+        """Returns the last lines of the log file.
+
+        Args:
+            num_lines (int): Maximum number of lines
+            level (str, optional): Minimum level of the lines (ie. 'INFO'). Defaults to
+            None (ie. all lines).
+
+        Returns:
+            dict: Lines, and offset to continue reading from (see read_since)
+        """
+        min_level = self.get_level_number(level)
+
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+
+            end = 0
+            lines = []
+            continuation = []
+            for i, line in enumerate(self._read_lines_backwards(f, size)):
+                if i == 0:
+                    # Whatever follows the last newline is a partially written line,
+                    # which is read once it's complete
+                    end = size - len(line)
+                    continue
+
+                if min_level is None:
+                    lines.append(line)
+                else:
+                    entry_level = self._get_entry_level(line)
+                    if entry_level is None:
+                        continuation.append(line)
+                        continue
+
+                    if entry_level >= min_level:
+                        lines.extend(continuation)
+                        lines.append(line)
+                    continuation = []
+
+                if len(lines) >= num_lines:
+                    break
+
+        lines = lines[:num_lines]
+        lines.reverse()
+
+        return {
+            "lines": [line.decode(errors="replace") for line in lines],
+            "offset": end,
+            "reset": False,
+        }
+
+    def read_since(self, offset:int, level:str=None) -> dict:
+        """Returns the lines written since the offset returned by the last read.
+
+        Args:
+            offset (int): Byte offset to read from
+            level (str, optional): Minimum level of the lines (ie. 'INFO'). Defaults to
+            None (ie. all lines).
+
+        Returns:
+            dict: Lines, the offset to continue reading from and whether the log file was
+            rotated (ie. the lines are read from the start of a new file)
+        """
+        min_level = self.get_level_number(level)
+
+        with open(self.path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+
+            # The file is smaller than before if it was rotated
+            reset = offset > size
+            if reset:
+                offset = 0
+
+            f.seek(offset)
+            data = f.read(min(size - offset, self.MAX_READ_BYTES))
+
+        # Only return complete lines, unless a single line fills the whole read
+        end = data.rfind(b"\n") + 1
+        if end == 0 and len(data) == self.MAX_READ_BYTES:
+            end = len(data)
+
+        lines = data[:end].split(b"\n")
+        if lines[-1] == b"":
+            lines.pop()
+
+        if min_level is not None:
+            filtered = []
+            keep = False
+            for line in lines:
+                entry_level = self._get_entry_level(line)
+                if entry_level is not None:
+                    keep = entry_level >= min_level
+                if keep:
+                    filtered.append(line)
+            lines = filtered
+
+        return {
+            "lines": [line.decode(errors="replace") for line in lines],
+            "offset": offset + end,
+            "reset": reset,
+        }
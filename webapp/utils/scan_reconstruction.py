@@ -0,0 +1,188 @@
+import numpy as np
+
+class ScanReconstruction(object):
+    """Reconstructs image frames from the raw byte stream of one slow axis period.
+
+    The slow axis is driven by a triangle wave, so one period consists of a forward sweep
+    followed by a reverse sweep over the same rows. Both half frames are built with one
+    reshape/flip of the contiguous byte stream (ie. no per-row bookkeeping), and are
+    returned as views.
+
+    Since both half frames image the same area, they can also be averaged. This improves
+    the signal to noise ratio by about sqrt(2) without increasing the scan time.
+
+    Parameters are calculated once on creation, so create a new instance whenever the
+    scan parameters change.
+    """
+    # The reverse half frame replaces rows of the forward half frame as it's received
+    MODE_OVERWRITE = "Overwrite"
+    # Rows are averaged with the forward half frame as the reverse half frame is received
+    MODE_AVERAGE = "Average"
+    # Only show one of the half frames
+    MODE_FORWARD = "Forward"
+    MODE_REVERSE = "Reverse"
+
+    MODES = (MODE_OVERWRITE, MODE_AVERAGE, MODE_FORWARD, MODE_REVERSE)
+
+    def __init__(self, bytes_per_row:int, rows_per_scan:int, mode:str=MODE_OVERWRITE, reverse_row_shift:int=0):
+        """
+        Args:
+            bytes_per_row (int): Number of samples per fast axis sweep
+            rows_per_scan (int): Number of fast axis sweeps per slow axis period
+            mode (str, optional): How the half frames are combined. One of MODES.
+            Defaults to MODE_OVERWRITE.
+            reverse_row_shift (int, optional): Number of rows the reverse half frame lags
+            behind the forward half frame (ie. due to the slow axis phase). Defaults to 0.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Half frame mode '{mode}' not allowed. Please select one of {self.MODES}.")
+
+        self.bytes_per_row = bytes_per_row
+        self.rows_per_scan = rows_per_scan
+        self.mode = mode
+
+        # Rows per half frame. If the number of rows is odd, the last row is dropped
+        self.rows_per_frame = rows_per_scan // 2
+        self.frame_shape = (self.rows_per_frame, bytes_per_row)
+
+        self.reverse_row_shift = max(min(reverse_row_shift, self.rows_per_frame), -self.rows_per_frame)
+
+        self._bytes_per_period = 2 * self.rows_per_frame * bytes_per_row
+
+        # Preallocated so frames can be aligned and averaged without allocating
+        self._aligned_reverse = np.empty(self.frame_shape, dtype=np.uint8)
+        self._sum = np.empty(self.frame_shape, dtype=np.uint16)
+
+    def split(self, stream:np.ndarray):
+        """Splits the byte stream of one slow axis period into its two half frames.
+
+        Args:
+            stream (np.ndarray): Contiguous uint8 data of at least one slow axis period,
+            either flat or with one row per fast axis sweep
+
+        Returns:
+            np.ndarray, np.ndarray: Forward and reverse half frames of shape
+            (rows per frame, bytes per row). The reverse half frame is flipped, so both
+            have the same row order.
+        """
+        half_frames = stream.reshape(-1)[:self._bytes_per_period].reshape(2, *self.frame_shape)
+
+        return half_frames[0], half_frames[1, ::-1]
+
+    def half_frames(self, stream:np.ndarray):
+        """Returns the forward and reverse half frames, with the reverse half frame
+        aligned to the forward half frame.
+
+        Rows at the edge of the reverse half frame which are shifted out of the frame by
+        the alignment are filled in with the forward half frame.
+
+        Args:
+            stream (np.ndarray): Contiguous uint8 data of one slow axis period
+
+        Returns:
+            np.ndarray, np.ndarray: Forward and aligned reverse half frames of shape
+            (rows per frame, bytes per row)
+        """
+        forward, reverse = self.split(stream)
+
+        shift = self.reverse_row_shift
+        if shift == 0:
+            return forward, reverse
+
+        aligned = self._aligned_reverse
+        if shift > 0:
+            aligned[:-shift] = reverse[shift:]
+            aligned[-shift:] = forward[-shift:]
+        else:
+            aligned[-shift:] = reverse[:shift]
+            aligned[:-shift] = forward[:-shift]
+
+        return forward, aligned
+
+    def reconstruct(self, stream:np.ndarray, rows_received:int, out:np.ndarray=None) -> np.ndarray:
+        """Builds the frame to display from a partially received slow axis period.
+
+        Rows from the reverse sweep are combined with the rows of the forward sweep (see
+        mode) as soon as they're received. Rows that haven't been received yet are left
+        as is.
+
+        Args:
+            stream (np.ndarray): Contiguous uint8 data of one slow axis period
+            rows_received (int): Number of rows received so far in the period
+            out (np.ndarray, optional): Frame to write into. Defaults to a new array.
+
+        Returns:
+            np.ndarray: Frame of shape (rows per frame, bytes per row)
+        """
+        if out is None:
+            out = np.empty(self.frame_shape, dtype=np.uint8)
+
+        forward, reverse = self.half_frames(stream)
+
+        if self.mode == self.MODE_FORWARD:
+            out[:] = forward
+            return out
+        elif self.mode == self.MODE_REVERSE:
+            out[:] = reverse
+            return out
+
+        # The reverse sweep fills the frame from the last row back to the first
+        reverse_rows = min(max(rows_received - self.rows_per_frame, 0), self.rows_per_frame)
+        boundary = self.rows_per_frame - reverse_rows
+
+        out[:boundary] = forward[:boundary]
+
+        if self.mode == self.MODE_AVERAGE:
+            # Sum in 16 bits to avoid overflowing before halving
+            total = self._sum[boundary:]
+            np.add(forward[boundary:], reverse[boundary:], out=total, dtype=np.uint16)
+            np.right_shift(total, 1, out=total)
+            out[boundary:] = total
+        else:
+            out[boundary:] = reverse[boundary:]
+
+        return out
+
+    def changed_rows(self, rows_before:int, rows_after:int):
+        """Returns the rows of the reconstructed frame which may have changed while the
+        number of received rows went from rows_before to rows_after.
+
+        Args:
+            rows_before (int): Number of rows received at the last reconstruction
+            rows_after (int): Number of rows received now
+
+        Returns:
+            int, int: Start and stop of the changed rows, which are empty if nothing
+            changed
+        """
+        h = self.rows_per_frame
+
+        # A new scan has started, so any row may have changed
+        if rows_after < rows_before:
+            return 0, h
+
+        # Rows of the forward sweep are stored in order
+        start = min(rows_before, h)
+        stop = min(rows_after, h)
+
+        if self.mode != self.MODE_FORWARD:
+            # Rows of the reverse sweep are stored from the last row back, and may be
+            # shifted by the alignment
+            reverse_before = min(max(rows_before - h, 0), h)
+            reverse_after = min(max(rows_after - h, 0), h)
+
+            if reverse_after > reverse_before:
+                shift = abs(self.reverse_row_shift)
+                reverse_start = max(h - reverse_after - shift, 0)
+                reverse_stop = min(h - reverse_before + shift, h)
+
+                if stop > start:
+                    start, stop = min(start, reverse_start), max(stop, reverse_stop)
+                else:
+                    start, stop = reverse_start, reverse_stop
+
+            if self.mode == self.MODE_REVERSE and self.reverse_row_shift == 0 and reverse_after == reverse_before:
+                # Rows of the forward sweep aren't displayed
+                return 0, 0
+
+        return start, stop
@@ -0,0 +1,120 @@
+import time
+import threading
+
+import numpy as np
+from loguru import logger
+
+class TelemetrySampler(object):
+    """Samples readings (ie. high voltage output) on a fixed schedule in a background
+    thread, and keeps a fixed-size history of them in memory.
+
+    Readers only ever copy from the history, so they never wait on the hardware.
+    """
+    def __init__(self, sample_function, fields:tuple, period_sec:float, history_length:int, on_sample=None):
+        """
+        Args:
+            sample_function (callable): Returns a dict with a float for each field
+            fields (tuple): Names of the sampled values
+            period_sec (float): Time between samples
+            history_length (int): Number of samples kept
+            on_sample (callable, optional): Invoked from the sampling thread with each new
+            sample (see latest). Defaults to None.
+        """
+        self.fields = tuple(fields)
+        self.period_sec = period_sec
+
+        self._sample_function = sample_function
+        self._on_sample = on_sample
+        self._lock = threading.Lock()
+
+        # Ring buffer with the timestamp of each sample in the first column
+        self._history = np.full((history_length, len(self.fields) + 1), np.nan)
+        self._num_samples = 0
+
+        self._thread = threading.Thread(target=self._thread_sample, name="TelemetrySampler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _thread_sample(self):
+        logger.info(f"Sampling {', '.join(self.fields)} every {self.period_sec} sec")
+
+        next_sample_time = time.monotonic()
+
+        while True:
+            try:
+                reading = self._sample_function()
+                row = [time.time()] + [reading[field] for field in self.fields]
+            except:
+                logger.exception("Could not sample telemetry")
+                row = None
+
+            if row is not None:
+                with self._lock:
+                    self._history[self._num_samples % len(self._history)] = row
+                    self._num_samples += 1
+
+                if self._on_sample is not None:
+                    try:
+                        self._on_sample(dict(zip(("time",) + self.fields, row)))
+                    except:
+                        logger.exception("Could not handle telemetry sample")
+
+            # Keep a fixed schedule, but skip missed samples instead of catching up
+            next_sample_time += self.period_sec
+            now = time.monotonic()
+            if next_sample_time < now:
+                next_sample_time = now + self.period_sec - (now - next_sample_time) % self.period_sec
+
+            time.sleep(next_sample_time - now)
+
+    def _get_samples(self) -> np.ndarray:
+        """Returns a copy of the samples in chronological order"""
+        with self._lock:
+            num_samples = min(self._num_samples, len(self._history))
+            end = self._num_samples % len(self._history)
+
+            if num_samples < len(self._history):
+                return self._history[:num_samples].copy()
+
+            return np.concatenate((self._history[end:], self._history[:end]))
+
+    def latest(self) -> dict:
+        """Returns the last sample with its timestamp, or None if nothing was sampled yet
+        """
+        with self._lock:
+            if self._num_samples == 0:
+                return None
+
+            row = self._history[(self._num_samples - 1) % len(self._history)].copy()
+
+        return dict(zip(("time",) + self.fields, row.tolist()))
+
+    def history(self, window_sec:float=None, max_points:int=100) -> dict:
+        """Returns the samples of the last window_sec seconds. If there are more than
+        max_points samples, they're decimated by averaging consecutive samples.
+
+        Args:
+            window_sec (float, optional): Length of the history. Defaults to None (ie.
+            everything kept).
+            max_points (int, optional): Maximum number of points returned. Defaults to 100.
+
+        Returns:
+            dict: List of values for the time and each field
+        """
+        samples = self._get_samples()
+
+        if window_sec is not None and len(samples):
+            samples = samples[samples[:, 0] >= samples[-1, 0] - window_sec]
+
+        if max_points > 0 and len(samples) > max_points:
+            # Average blocks of consecutive samples, dropping the oldest ones which
+            # don't fill a block
+            block = -(-len(samples) // max_points)
+            num_points = len(samples) // block
+            samples = samples[len(samples) - num_points * block:]
+            samples = samples.reshape(num_points, block, -1).mean(axis=1)
+
+        return {
+            name: samples[:, column].tolist()
+            for column, name in enumerate(("time",) + self.fields)
+        }
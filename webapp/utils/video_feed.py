@@ -3,22 +3,21 @@ import io
 import time
 import threading
 import numpy as np
-from PIL import Image
-from PIL.ImageOps import invert
+from PIL import Image, features
 from matplotlib.cm import get_cmap
 from matplotlib.colors import Normalize
 
 from loguru import logger
 
 from awesem import is_machine_raspberry_pi
+from awesem.log_aggregator import LogAggregator
 from awesem.image_scan_control import ImageScanControl
+from awesem.image_scan_process import ImageScanProcess
 from webapp.utils.base_video_feed import BaseVideoFeed
-from webapp.configs import config, WEBAPP_FILE_DIRECTORY
-
-# Used to set log level
-import sys
-logger.remove()
-logger.add(sys.stderr, level="DEBUG")
+from webapp.utils.scan_reconstruction import ScanReconstruction
+from webapp.utils.frame_resampler import FrameResampler
+from webapp.configs import config, get_setting, WEBAPP_FILE_DIRECTORY
+from webapp.utils.jobs import Job
 
 class VisualizeData(object):
     COLORMAP_MAX = 255
@@ -29,13 +28,49 @@ class VisualizeData(object):
     IMAGE_RESOLUTION_X_PIXEL = 200
     IMAGE_RESOLUTION_Y_PIXEL = 200
 
+    # Supported image formats for streaming, and their content type. PNG is lossless but
+    # slow to encode, so it's mainly meant for saving images
+    IMAGE_MIMETYPES = {
+        "JPEG": "image/jpeg",
+        "WEBP": "image/webp",
+        "PNG": "image/png",
+    }
+
     def __init__(self):
         self._colormap_max = self.COLORMAP_MAX
         self._colormap_min = self.COLORMAP_MIN
 
+        self.image_format = self.get_image_format(config["VideoFeed"]["Format"])
+        self.image_quality = config["VideoFeed"].getint("Quality")
+
+        # Lookup table from 8-bit pixel values to RGB colors. Only rebuilt when the
+        # colormap or contrast changes
+        self._lut = None
+        self._lut_cmap = None
+        self._rgb_buffer = None
+
+        # Resampling plan from the data matrix to the output image
+        self._resampler = None
+
+        # Colored pixels and output image, which are updated in place when only some
+        # columns changed. Rebuilt when the resampling plan or lookup table changes.
+        self._image_resampler = None
+        self._image_lut = None
+        self._output_buffer = None
+
+        # Incremented whenever a setting changes the rendered image
+        self.version = 0
+
+        self.set_resolution()
+
     def set_resolution(self):
-        self.IMAGE_RESOLUTION_X_PIXEL = config["User.ScanSettings"].getfloat("Resolution")
-        self.IMAGE_RESOLUTION_Y_PIXEL = config["User.ScanSettings"].getfloat("Resolution")
+        """Updates the output image resolution and resample filter from the config.
+        Resampling is planned again on the next plot.
+        """
+        self.IMAGE_RESOLUTION_X_PIXEL = get_setting("User.ScanSettings", "Resolution", int)
+        self.IMAGE_RESOLUTION_Y_PIXEL = get_setting("User.ScanSettings", "Resolution", int)
+        self.resample_filter = get_setting("VideoFeed", "ResampleFilter")
+        self.version += 1
 
     def set_contrast(self, value:int):
         """Set the contrast of the displayed image. Can be updated live.
@@ -48,6 +83,8 @@ class VisualizeData(object):
             value (int): 8-bit range from 0-255
         """
         self._colormap_max = self.COLORMAP_MAX - value
+        self._lut = None
+        self.version += 1
         logger.debug(f"Set contrast to {self._colormap_max} bits")
 
     def get_normalized(self, value:float)->float:
@@ -61,70 +98,228 @@ class VisualizeData(object):
         """
         return (self._colormap_max - self._colormap_min)*value
 
-    def generate_plot(self, img_array: np.ndarray, cmap='Greys', grid=False):
+    def _get_lut(self, cmap:str) -> np.ndarray:
+        """Returns the lookup table from 8-bit pixel values to RGB colors, and rebuilds
+        it if the colormap or contrast has changed.
+
+        Args:
+            cmap (str): Colormap type
+
+        Returns:
+            np.ndarray: 256x3 uint8 array of RGB colors
+        """
+        lut = self._lut
+        if lut is not None and cmap == self._lut_cmap:
+            return lut
+
+        color_map = get_cmap(cmap)
+        norm = Normalize(vmin=self._colormap_min, vmax=self._colormap_max)
+
+        # Pixel values are inverted before applying the colormap
+        values = self.COLORMAP_MAX - np.arange(self.COLORMAP_MAX + 1)
+        lut = (color_map(norm(values))[:, :3] * 255).astype(np.uint8)
+
+        self._lut = lut
+        self._lut_cmap = cmap
+        logger.debug(f"Built lookup table for colormap {cmap}")
+
+        return lut
+
+    def get_image_format(self, image_format:str) -> str:
+        """Returns the given image format if it can be streamed, otherwise the closest
+        format which can.
+
+        Args:
+            image_format (str): Requested format (ie. 'jpeg', 'webp', 'png')
+
+        Returns:
+            str: Image format supported by PIL
+        """
+        image_format = image_format.upper()
+        if image_format == "JPG":
+            image_format = "JPEG"
+
+        if image_format not in self.IMAGE_MIMETYPES:
+            logger.warning(f"Image format {image_format} not supported. Using JPEG instead.")
+            return "JPEG"
+
+        if image_format == "WEBP" and not features.check("webp"):
+            logger.warning("Pillow was built without WebP support. Using JPEG instead.")
+            return "JPEG"
+
+        return image_format
+
+    def _get_resampler(self, source_shape:tuple) -> FrameResampler:
+        """Returns the resampling plan from the data matrix to the output image, and
+        plans it again if the shape, resolution or filter has changed.
+        """
+        size = (self.IMAGE_RESOLUTION_X_PIXEL, self.IMAGE_RESOLUTION_Y_PIXEL)
+
+        resampler = self._resampler
+        if (resampler is not None and resampler.source_shape == source_shape
+                and resampler.output_size == size and resampler.resample_filter == self.resample_filter):
+            return resampler
+
+        try:
+            resampler = FrameResampler(source_shape, size, self.resample_filter)
+        except ValueError:
+            logger.exception(f"Could not plan resampling. Using {FrameResampler.FILTER_NEAREST} instead.")
+            self.resample_filter = FrameResampler.FILTER_NEAREST
+            resampler = FrameResampler(source_shape, size, self.resample_filter)
+
+        self._resampler = resampler
+        logger.debug(f"Resampling {source_shape} to {size} with filter {resampler.resample_filter}")
+
+        return resampler
+
+    def generate_plot(self, img_array: np.ndarray, cmap='Greys', grid=False, columns=None) -> Image:
         """Plots a matrix to a heatmap
 
+        The resampled and colored image is kept, so if only some columns of the matrix
+        changed since the last plot, only the output columns sampling them are updated.
+
         Args:
             img_array (np.ndarray): 2D matrix of scanned frame
             cmap (str, optional): Colormap type. Defaults to 'Greys'.
             grid (bool, optional): Whether to show the grid. Defaults to False.
+            columns (tuple, optional): Start and stop of the columns which changed since
+            the last plot. Defaults to None (ie. all of them).
 
         Returns:
-            bytes, Image: Byte object of image (for streaming) and figure handle (for saving)
+            Image: Image of the plotted frame (see encode for streaming it)
         """
         logger.trace('----')
 
         start_time = time.time()
-        buf = io.BytesIO()
-        color_map = get_cmap(cmap)
-        norm = Normalize(vmin=self._colormap_min, vmax=self._colormap_max)
+        lut = self._get_lut(cmap)
         logger.trace(time.time() - start_time)
 
         start_time = time.time()
-        # L mode indiciates the array values represent luminance, which creates a grayscale image
-        img = Image.fromarray(img_array.astype('uint8'), 'L')
-        img = invert(img)
-
-        # Convert the grayscale image to the desired colormap. Requires casting back and forth
-        # between PIL image and numpy array, but only takes ~0.015s on Raspberry Pi 4 (so
-        # performance is still good)
-        colored_img = color_map(norm(np.array(img)))
-        img = Image.fromarray((colored_img[:, :, :3] * 255).astype(np.uint8))
+        img_array = img_array.astype(np.uint8, copy=False)
+        resampler = self._get_resampler(img_array.shape)
+
+        if resampler is not self._image_resampler or lut is not self._image_lut:
+            self._image_resampler = resampler
+            self._image_lut = lut
+            self._rgb_buffer = None
+            self._output_buffer = None
+            columns = None
+
+        start, stop = (0, img_array.shape[1]) if columns is None else columns
+        out_start, out_stop = resampler.output_columns(start, stop)
+
+        if resampler.colors_output:
+            # Resample first, so only the output pixels are colored
+            if self._rgb_buffer is None:
+                out_width, out_height = resampler.output_size
+                self._rgb_buffer = np.empty((out_height, out_width, 3), dtype=np.uint8)
+
+            if out_stop > out_start:
+                values = resampler.resample(img_array, out_start, out_stop)
+                # Color each pixel by indexing the lookup table with its 8-bit value
+                np.take(lut, values, axis=0, out=self._rgb_buffer[:, out_start:out_stop], mode='clip')
+
+            img = Image.fromarray(self._rgb_buffer, 'RGB')
+        else:
+            if self._rgb_buffer is None:
+                self._rgb_buffer = np.empty(img_array.shape + (3,), dtype=np.uint8)
+                self._output_buffer = Image.new('RGB', resampler.output_size)
+
+            if out_stop > out_start:
+                np.take(lut, img_array[:, start:stop], axis=0, out=self._rgb_buffer[:, start:stop], mode='clip')
+
+                # Stretch/squish the data buffer to the desired output image resolution
+                region = resampler.resize(self._rgb_buffer, out_start, out_stop)
+                self._output_buffer.paste(region, (out_start, 0))
+
+            # Copy, since clients may still be encoding the image while the next one is
+            # plotted
+            img = self._output_buffer.copy()
 
+        logger.trace(time.time() - start_time)
 
-        self.IMAGE_RESOLUTION_X_PIXEL = int(config["User.ScanSettings"].getfloat("Resolution"))
-        self.IMAGE_RESOLUTION_Y_PIXEL = int(config["User.ScanSettings"].getfloat("Resolution"))
+        return img
 
+    def encode(self, img:Image, image_format:str=None, quality:int=None) -> bytes:
+        """Encodes an image for streaming
 
-        # Stretch/squish the data buffer to the desired output image resolution
-        img = img.resize((self.IMAGE_RESOLUTION_X_PIXEL, self.IMAGE_RESOLUTION_Y_PIXEL))
+        Args:
+            img (Image): Image returned by generate_plot
+            image_format (str, optional): One of IMAGE_MIMETYPES. Defaults to the
+            configured format.
+            quality (int, optional): Quality from 1-95 for lossy formats. Defaults to the
+            configured quality.
 
-        logger.trace(time.time() - start_time)
+        Returns:
+            bytes: Encoded image
+        """
+        image_format = image_format or self.image_format
+        quality = quality or self.image_quality
 
         start_time = time.time()
-        img.save(buf, format="png")
+        buf = io.BytesIO()
+
+        if image_format == "PNG":
+            img.save(buf, format=image_format)
+        else:
+            img.save(buf, format=image_format, quality=quality)
+
         logger.trace(time.time() - start_time)
 
-        buf.seek(0)
-        return buf.read(), img
+        return buf.getvalue()
 
 class VideoFeed(BaseVideoFeed):
     """A video feed implementation to serve a continually updating plotted image
     """
     IMAGE_FILENAME = "awesem-scan.png"
     BLANK_STARTUP_IMAGE_VALUE = 0.75   # show a grayish color (scale from 0-1.0, inverted)
-
-    def __init__(self):
+    # Maximum delay before display settings changes (ie. contrast) are rendered
+    RENDER_POLL_SEC = 0.1
+    # Minimum time between progress updates of the calibration job and the event stream
+    PROGRESS_INTERVAL_SEC = 0.25
+    # Time over which render statistics are aggregated before they're published
+    RENDER_STATS_INTERVAL_SEC = 1.0
+
+    def __init__(self, events=None):
+        """
+        Args:
+            events (EventStream, optional): Receives the scan state and acquisition
+            statistics (ie. for the web page). Defaults to None.
+        """
+        self.events = events
         self._show_startup_image = True
         self._is_paused = True
         self._figure = None
         self._run_calibration = False
+        self._calibration_job = None
         self._show_calibration = config["BeamAlignment"].getboolean("MapEnabled")
-        self._ignore_data = False
+        self._zero_copy_ingest = config["Acquisition"].getboolean("ZeroCopyIngest")
 
         self.visualize = VisualizeData()
 
-        self.scan_control_handler = ImageScanControl()
+        # Guards the scan buffer and the data matrix, which are replaced whenever the
+        # scan parameters change
+        self._frame_lock = threading.Lock()
+
+        # Incremented whenever the data matrix changes (ie. a row is received), so frames
+        # are only rendered when there's something new to show
+        self._data_version = 0
+        self._render_event = threading.Event()
+
+        # Columns of the data matrix which changed since the last frame was rendered
+        self._dirty_columns = (0, 0)
+
+        # Short rows can repeat on every row, so they're summarized instead
+        self._short_row_log = LogAggregator(
+            interval_sec=get_setting("Logging", "RepeatedMessageIntervalSec", float)
+        )
+
+        if config["Acquisition"].getboolean("ReaderProcess") and ImageScanProcess.is_supported():
+            self.scan_control_handler = ImageScanProcess()
+        else:
+            if config["Acquisition"].getboolean("ReaderProcess"):
+                logger.warning("Reader process requires python 3.8 or greater. Reading data in a thread instead.")
+            self.scan_control_handler = ImageScanControl()
 
         self.scan_control_handler.set_sampling_frequency(
             config["General"].getfloat("SamplingFrequencyHz")
@@ -148,18 +343,47 @@ class VideoFeed(BaseVideoFeed):
         """
         self._show_startup_image = False
         self._is_paused = False
+        self._render_event.set()
+        self._publish_scan_state("running")
 
     def pause(self):
         """Stops the frames from updating
         """
         self._is_paused = True
-
+        self._abort_calibration_job()
+        self._publish_scan_state("paused")
 
     def stop(self):
         """Resets the frame buffer and shows the startup image
         """
         self._show_startup_image = True
         self._is_paused = True
+        self._abort_calibration_job()
+        self._render_event.set()
+        self._publish_scan_state("stopped")
+
+    def _abort_calibration_job(self):
+        """Finishes a running calibration job as aborted. Otherwise it would never finish
+        if the scan is stopped before the reader starts it.
+        """
+        job = self._calibration_job
+        if self._run_calibration and job is not None and not job.is_done:
+            job.finish(Job.STATUS_ABORTED)
+            logger.info("Calibration aborted")
+
+    def _publish(self, event_type:str, **data):
+        """Sends an event to the event stream, if any
+        """
+        if self.events is not None:
+            self.events.publish(event_type, **data)
+
+    def _publish_scan_state(self, state:str):
+        self._publish("scan_state", state=state, calibrating=self._run_calibration)
+
+    def encode_frame(self, frame:Image, image_format:str=None, quality:int=None) -> bytes:
+        """Encodes a frame for streaming (see VisualizeData.encode)
+        """
+        return self.visualize.encode(frame, image_format, quality)
 
     def save(self):
         """Saves the last frame to an image file
@@ -174,30 +398,54 @@ class VideoFeed(BaseVideoFeed):
 
         return WEBAPP_FILE_DIRECTORY, self.IMAGE_FILENAME
 
-    def run_calibration(self):
+    def run_calibration(self, job=None):
+        """Runs the beam alignment scan in the background.
+
+        Args:
+            job (Job, optional): Updated with the progress of the scan (ie. rows received
+            and max sample), and finished with it. Defaults to None.
+        """
         logger.debug("Starting calibration")
 
         self.set_axis_frequency(
             "beam",
-            config["BeamAlignment"].getfloat("SlowAxisScanRateHz"),
-            config["BeamAlignment"].getfloat("FastAxisScanRateHz"),
+            get_setting("BeamAlignment", "SlowAxisScanRateHz", float),
+            get_setting("BeamAlignment", "FastAxisScanRateHz", float),
             0.0 #no need to change the sampling frequency if we're just running the beam alignment
         )
 
         self._show_startup_image = False
 
-        self._show_calibration = config["BeamAlignment"].getboolean("MapEnabled")
+        self._show_calibration = get_setting("BeamAlignment", "MapEnabled", bool)
+        self._calibration_job = job
         self._run_calibration = True
         self._is_paused = False
+        self._publish_scan_state("running")
 
     @property
     def is_calibrating(self):
         return self._run_calibration
 
-    def stop_calibration(self):
+    @property
+    def calibration_job(self):
+        """Job of the current or last calibration, if any"""
+        return self._calibration_job
+
+    def stop_calibration(self, status:str=Job.STATUS_COMPLETE):
+        """Ends the calibration and finishes its job, if any.
+
+        Args:
+            status (str, optional): Status of the job (ie. Job.STATUS_ABORTED if the scan
+            was stopped). Defaults to Job.STATUS_COMPLETE.
+        """
         logger.debug("Stopping calibration")
         self._run_calibration = False
         self._is_paused = True
+        self._publish_scan_state("paused")
+
+        if self._calibration_job is not None and not self._calibration_job.is_done:
+            self._calibration_job.finish(status)
+            logger.info(f"Calibration {status}")
 
     def set_axis_frequency(self, component:str, slow_axis_hz:float, fast_axis_hz:float, sampling_frequency_hz:float):
         """Set mechanical stage scanning frequency and initialize data array based on
@@ -209,38 +457,123 @@ class VideoFeed(BaseVideoFeed):
 
         logger.info(f"Initializing with data buffer resolution {self.scan_control_handler.data_buffer_resolution_effective}")
 
-        self.data = np.full(
-            self.scan_control_handler.data_buffer_resolution_effective,
-            self.visualize.get_normalized(self.BLANK_STARTUP_IMAGE_VALUE)
+        bytes_per_row, rows_per_scan = self.scan_control_handler.data_buffer_resolution
+        blank_value = self.visualize.get_normalized(self.BLANK_STARTUP_IMAGE_VALUE)
+
+        if self._zero_copy_ingest:
+            # Rows are read straight into the ring buffer, which holds the raw data of a
+            # full scan (ie. one slow axis period)
+            stream = self.scan_control_handler.allocate_ring_buffer()
+        else:
+            stream = np.empty((rows_per_scan, bytes_per_row), dtype=np.uint8)
+        stream[:, :] = blank_value
+
+        reconstruction = ScanReconstruction(
+            bytes_per_row,
+            rows_per_scan,
+            mode=get_setting("Acquisition", "HalfFrameMode"),
+            reverse_row_shift=get_setting("Acquisition", "ReverseRowShift", int)
         )
+        frame = np.full(reconstruction.frame_shape, blank_value, dtype=np.uint8)
+
+        with self._frame_lock:
+            self._stream = stream
+            self._reconstruction = reconstruction
+            self._rows_received = 0
+            self._rows_reconstructed = 0
+
+            # The data matrix has one column per row of the scan
+            self.data = frame.T
+            self._data_version += 1
+            self._dirty_columns = (0, self.data.shape[1])
+
+        self._render_event.set()
+
+    def _reconstruct_frame(self):
+        """Updates the data matrix with the rows received since it was last updated
+        """
+        with self._frame_lock:
+            rows_received = self._rows_received
+            if rows_received == self._rows_reconstructed:
+                return
+
+            self._reconstruction.reconstruct(self._stream, rows_received, out=self.data.T)
+            self._add_dirty_columns(
+                *self._reconstruction.changed_rows(self._rows_reconstructed, rows_received)
+            )
+            self._rows_reconstructed = rows_received
+
+    def _clear_frame(self):
+        """Shows a blank frame until new rows are received
+        """
+        with self._frame_lock:
+            self.data[:,:] = self.visualize.get_normalized(self.BLANK_STARTUP_IMAGE_VALUE)
+            self._rows_reconstructed = self._rows_received
+            self._data_version += 1
+            self._dirty_columns = (0, self.data.shape[1])
+
+    def _add_dirty_columns(self, start:int, stop:int):
+        """Marks columns of the data matrix as changed. Must hold the frame lock.
+        """
+        if stop <= start:
+            return
+
+        dirty_start, dirty_stop = self._dirty_columns
+        if dirty_stop <= dirty_start:
+            self._dirty_columns = (start, stop)
+        else:
+            self._dirty_columns = (min(start, dirty_start), max(stop, dirty_stop))
+
+    def _pop_dirty_columns(self):
+        """Returns the start and stop of the columns that changed since the last call
+        """
+        with self._frame_lock:
+            columns = self._dirty_columns
+            self._dirty_columns = (0, 0)
+
+        return columns
 
     def _thread_read_data(self):
-        """Main thread to populate the data matrix (ie. from UART)
+        """Main thread to read the raw scan data (ie. from UART)
 
-        Populates the image data matrix from each serial read, where the number of bytes
-        read correlates to the number of pixels per row in the scan. Row index is kept
-        track here (ie. not the Teensy) since the Teensy only outputs ADC values (which
-        would correlate with each element in the image data matrix)
+        Each serial read corresponds to one row of the scan (ie. one sweep of the fast
+        axis), and is stored in order in a buffer holding one full scan. The buffer is
+        turned into the displayed frame by ScanReconstruction, so no row index or scan
+        direction is tracked here.
 
-        Once the image matrix has been populated, there still may be some data left in the
+        Once a full scan has been received, there still may be some data left in the
         buffer (but may not consist of a full row of data). In this case, data is still
-        read but it's not added to the image matrix.
+        read but it's not added to the scan buffer.
         """
-        
         while True:
             if not self._is_paused:
-                self._ignore_data = False
                 self.scan_control_handler.start_scan(calibration_mode=self._run_calibration)
 
+                # Scan parameters only change between scans, so look them up once
+                with self._frame_lock:
+                    stream = self._stream
+                    rows_per_scan = 2 * self._reconstruction.rows_per_frame
+                    self._rows_received = 0
+                    self._rows_reconstructed = 0
+                    # Rows of the previous scan are replaced as soon as the first row
+                    # is reconstructed
+                    self._dirty_columns = (0, self.data.shape[1])
+                bytes_per_row = stream.shape[1]
+                rows_received = 0
+
+                calibration_job = self._calibration_job if self._run_calibration else None
+                max_sample = 0
+                last_progress_time = 0
+
                 total_bytes_read = 0
+                short_rows = 0
                 start_time = time.time()
-
-                index = 0
-                scanning_forward = True
-
+                self._publish("scan_started", rows_per_scan=rows_per_scan, bytes_per_row=bytes_per_row)
+                aborted = False
 
                 while True:
                     if self._is_paused:
+                        aborted = True
                         logger.info("Stopping scan control")
                         self.scan_control_handler.stop_scan()
                         break
@@ -250,83 +583,185 @@ class VideoFeed(BaseVideoFeed):
                         break
 
                     total_bytes_read += len(buffer)
-                    logger.trace(f"Received {len(buffer)} bytes")
-
-                    # Every even row is flipped since direction is reversed
-                    # if index % 2 == 0:
-                    #     buffer = np.flip(buffer)
+                    # Formatted lazily, since this is logged on every row
+                    logger.trace("Received {} bytes", len(buffer))
 
-                    # Data will be ignored if the image has been fully constructed. But we
+                    # Data will be ignored if the scan has been fully received. But we
                     # still need to read the data so the waveform completes fully
-                    if not self._ignore_data:
-                        if len(buffer) == self.scan_control_handler.data_buffer_resolution_effective[0]:
-                            # Populate the image data with new row from data buffer
-                            self.data[:,index] = buffer
+                    if rows_received < rows_per_scan:
+                        if len(buffer) == bytes_per_row:
+                            # With zero-copy ingest, the row has already been read into place
+                            if not self._zero_copy_ingest:
+                                stream[rows_received] = buffer
                         else:
-                            logger.warning(f"Received {len(buffer)}, but does not fill a row of size {self.scan_control_handler.data_buffer_resolution_effective[0]}")
-
-                    # Switch directions halfway through buffer (since slow axis is triangle wave)
-                    # Subtract 1 in case index is out of range due to integer casting truncation
-                    if index >= (self.scan_control_handler.data_buffer_resolution_effective[1] - 1) and scanning_forward:
-                        scanning_forward = False
-                        logger.debug(f"Scan direction: reverse")
-
-                    elif index <= 0 and not scanning_forward:
-                        scanning_forward = True
-                        self._ignore_data = True
-                        logger.debug(f"End of scan reached. Ignoring subsequent data in buffer. Total bytes received: {total_bytes_read}")
-
-                        # Break if webapp is being run locally (ie. no hardware plugged in),
-                        # since the read_buffer command will never return None
-                        if not is_machine_raspberry_pi():
-                            break
-
-                    if scanning_forward:
-                        index += 1
-                    else:
-                        index -= 1
+                            self._short_row_log.log("Received {}, but does not fill a row of size {}", len(buffer), bytes_per_row)
+                            short_rows += 1
+
+                        rows_received += 1
+                        self._rows_received = rows_received
+                        self._data_version += 1
+                        self._render_event.set()
+
+                        if calibration_job is not None:
+                            max_sample = max(max_sample, int(buffer.max()))
+
+                        now = time.time()
+                        if now - last_progress_time > self.PROGRESS_INTERVAL_SEC or rows_received == rows_per_scan:
+                            if calibration_job is not None:
+                                calibration_job.update(
+                                    rows_received=rows_received,
+                                    rows_per_scan=rows_per_scan,
+                                    max_sample=max_sample
+                                )
+
+                            elapsed_time = now - start_time
+                            self._publish(
+                                "scan_progress",
+                                rows_received=rows_received,
+                                rows_per_scan=rows_per_scan,
+                                bytes_read=total_bytes_read,
+                                throughput_bytes_per_sec=total_bytes_read / elapsed_time if elapsed_time > 0 else 0.0,
+                                short_rows=short_rows
+                            )
+                            last_progress_time = now
+
+                        if rows_received == rows_per_scan:
+                            logger.debug(f"End of scan reached. Ignoring subsequent data in buffer. Total bytes received: {total_bytes_read}")
+
+                            # Break if webapp is being run locally (ie. no hardware plugged in),
+                            # since the read_buffer command will never return None
+                            if not is_machine_raspberry_pi():
+                                break
 
                 if self._run_calibration:
-                    if not self._show_calibration:
+                    if self._show_calibration:
+                        self._reconstruct_frame()
+                    else:
                         # Show blank when calibration is done, otherwise the calibration
                         # data buffer will be displayed
-                        self.data[:,:] = self.visualize.get_normalized(self.BLANK_STARTUP_IMAGE_VALUE)   # show a grayish color
+                        self._clear_frame()
+
+                    if aborted:
+                        status = Job.STATUS_ABORTED
+                    elif rows_received < rows_per_scan:
+                        # Data stopped before the end of the scan
+                        status = Job.STATUS_FAILED
+                    else:
+                        status = Job.STATUS_COMPLETE
+                    self.stop_calibration(status)
 
-                    self.stop_calibration()
+                self._short_row_log.flush()
 
                 elapsed_time = time.time() - start_time
                 logger.info(f"Elapsed time for scan: {elapsed_time:.2f} sec")
+                self._publish(
+                    "scan_complete",
+                    rows_received=rows_received,
+                    rows_per_scan=rows_per_scan,
+                    bytes_read=total_bytes_read,
+                    elapsed_sec=elapsed_time,
+                    throughput_bytes_per_sec=total_bytes_read / elapsed_time if elapsed_time > 0 else 0.0,
+                    short_rows=short_rows
+                )
 
             # Arbitrary delay
             time.sleep(0.02)
 
+    def _get_render_state(self):
+        """Returns what the displayed frame depends on. A new frame is only rendered
+        when this changes.
+        """
+        if self._show_startup_image:
+            return ("startup", self.visualize.version)
+
+        if self._run_calibration:
+            return ("calibration", self._show_calibration, self._data_version, self.visualize.version)
+
+        return ("live", self._data_version, self.visualize.version)
+
     def frames(self):
         """Main loop that creates an image plot from the data matrix
+
+        Frames are only rendered if a client is watching and the data matrix or the
+        display settings have changed since the last frame. At most [VideoFeed] MaxFps
+        frames are rendered per second, rows received in between are rendered together.
         """
         logger.debug("Starting frames")
 
+        last_render_state = None
+
+        # Render statistics since they were last published
+        render_count = 0
+        render_time = 0.0
+        render_max_time = 0.0
+        stats_start_time = time.time()
+        last_render_time = 0.0
+
         while True:
-            if self._show_startup_image:
-                self.data[:,:] = self.visualize.get_normalized(self.BLANK_STARTUP_IMAGE_VALUE)
+            self._render_event.wait(timeout=self.RENDER_POLL_SEC)
+
+            if self.broadcaster.num_subscribers == 0:
+                self._render_event.clear()
+                continue
+
+            # The reader signals every row, so rows are merged until the frame interval
+            # has passed
+            delay = last_render_time + 1.0 / get_setting("VideoFeed", "MaxFps", float) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self._render_event.clear()
+
+            render_state = self._get_render_state()
+            if render_state == last_render_state:
+                continue
+            last_render_state = render_state
+            render_start_time = time.time()
+            last_render_time = render_start_time
+            if render_count == 0:
+                # Don't count the idle time before the first render
+                stats_start_time = render_start_time
 
-                image_buffer, self._figure = self.visualize.generate_plot(self.data, cmap='Greys', grid=True)
-                yield image_buffer
+            if self._show_startup_image:
+                self._clear_frame()
+                self._pop_dirty_columns()
 
-                # Add a small sleep to reduce burden on CPU when paused
-                time.sleep(0.25)
+                self._figure = self.visualize.generate_plot(self.data, cmap='Greys', grid=True)
 
             else:
-                # Show live data. No need to sleep since frames should be displayed as
-                # quickly as possible
+                # Show live data
                 if self._run_calibration:
                     if self._show_calibration:
+                        self._reconstruct_frame()
                         # Optional: Change color map for calibration (ie. to 'viridis')
-                        image_buffer, self._figure = self.visualize.generate_plot(self.data, cmap="Greys")
+                        self._figure = self.visualize.generate_plot(
+                            self.data, cmap="Greys", columns=self._pop_dirty_columns()
+                        )
                     else:
-                        pass
+                        # Keep showing the last frame
+                        continue
                 else:
-                    image_buffer, self._figure = self.visualize.generate_plot(self.data)
-                yield image_buffer
-                
-                if self._is_paused:
-                    time.sleep(0.25)
+                    self._reconstruct_frame()
+                    self._figure = self.visualize.generate_plot(
+                        self.data, columns=self._pop_dirty_columns()
+                    )
+
+            now = time.time()
+            render_count += 1
+            render_time += now - render_start_time
+            render_max_time = max(render_max_time, now - render_start_time)
+
+            if now - stats_start_time >= self.RENDER_STATS_INTERVAL_SEC:
+                self._publish(
+                    "render",
+                    frames=render_count,
+                    fps=render_count / (now - stats_start_time),
+                    render_ms_mean=1000 * render_time / render_count,
+                    render_ms_max=1000 * render_max_time,
+                    subscribers=self.broadcaster.num_subscribers
+                )
+                render_count = 0
+                render_time = 0.0
+                render_max_time = 0.0
+                stats_start_time = now
+
+            yield self._figure
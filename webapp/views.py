@@ -1,7 +1,8 @@
-from flask import render_template, Blueprint, Response
+from flask import render_template, Blueprint, Response, request
 
 from webapp.configs import config, LOG_FILE_PATH
 from webapp import video_feed_handler
+from webapp.utils.log_reader import LogReader
 
 bp = Blueprint("views", __name__)
 
@@ -18,27 +19,53 @@ def internal_server_error():
 def advanced():
     return render_template("advanced.html", config=config)
 
+# Number of lines shown when the logs page is opened
+LOG_TAIL_LINES = 250
+
 @bp.route('/logs.html')
 def logs():
-    with open(LOG_FILE_PATH, 'r') as f:
-        data = f.readlines()
-
-    # Only show the last hundred or so lines of the file
-    logs = data[-250:]
-    logs = "".join(logs)
+    """Shows the end of the log file. The page then follows the log with /api/logs.
+    """
+    level = request.args.get("level", "")
+    try:
+        tail = LogReader(LOG_FILE_PATH).tail(LOG_TAIL_LINES, level)
+    except ValueError:
+        level = ""
+        tail = LogReader(LOG_FILE_PATH).tail(LOG_TAIL_LINES)
 
-    return render_template("logs.html", logfile=LOG_FILE_PATH, logs=logs)
+    return render_template("logs.html", logfile=LOG_FILE_PATH, logs="\n".join(tail["lines"]),
+                           offset=tail["offset"], level=level.upper())
 
-def gen(camera):
+def gen(camera, image_format, quality=None):
     """Video streaming generator function."""
-    while True:
-        frame = camera.get_frame()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    header = (b'--frame\r\n'
+              b'Content-Type: ' + camera.visualize.IMAGE_MIMETYPES[image_format].encode() + b'\r\n\r\n')
+
+    subscription = camera.subscribe()
+    try:
+        while True:
+            frame = camera.get_frame(subscription, image_format, quality)
+            if frame is None:
+                # The client was too slow to keep up and has been removed
+                break
+
+            yield header + frame + b'\r\n'
+    finally:
+        camera.unsubscribe(subscription)
 
 
 @bp.route('/video_feed')
 def video_feed():
-    """Video streaming route. Put this in the src attribute of an img tag."""
-    return Response(gen(video_feed_handler),
+    """Video streaming route. Put this in the src attribute of an img tag.
+
+    The encoding can be chosen per stream (ie. /video_feed?format=webp&quality=60).
+    Defaults to the format and quality in the config.
+    """
+    visualize = video_feed_handler.visualize
+
+    image_format = visualize.get_image_format(request.args.get("format", visualize.image_format))
+    quality = request.args.get("quality", visualize.image_quality, type=int)
+    quality = max(1, min(quality, 95))
+
+    return Response(gen(video_feed_handler, image_format, quality),
                     mimetype='multipart/x-mixed-replace; boundary=frame')